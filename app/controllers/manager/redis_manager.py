@@ -9,6 +9,7 @@ from app.services import task as tm
 
 FUNC_MAP = {
     "start": tm.start,
+    "promote_to_final": tm.promote_to_final,
     # 'start_test': tm.start_test
 }
 
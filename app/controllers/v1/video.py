@@ -25,9 +25,13 @@ from app.models.schema import (
     TaskQueryResponse,
     TaskResponse,
     TaskVideoRequest,
+    TimelineRequest,
+    TimelineResponse,
 )
 from app.services import state as sm
 from app.services import task as tm
+from app.services import timeline
+from app.services.utils import ffmpeg
 from app.utils import utils
 
 # 认证依赖项
@@ -95,6 +99,89 @@ def create_task(
         )
 
 
+@router.post(
+    "/tasks/{task_id}/final",
+    response_model=TaskResponse,
+    summary="Render a finished (draft) task again with the final profile",
+)
+def promote_video(
+    request: Request,
+    task_id: str = Path(..., description="Task ID"),
+):
+    request_id = base.get_task_id(request)
+    if not sm.state.get_task(task_id):
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+
+    # rendered with the params the draft was made with, saved in the task
+    task = {
+        "task_id": task_id,
+        "request_id": request_id,
+    }
+    task_manager.add_task(tm.promote_to_final, task_id=task_id)
+    logger.success(f"Task promoted: {utils.to_json(task)}")
+    return utils.get_response(200, task)
+
+
+@router.post(
+    "/timeline",
+    response_model=TimelineResponse,
+    summary="Plan the video timeline without rendering (dry run)",
+)
+def plan_timeline(request: Request, body: TimelineRequest):
+    request_id = base.get_task_id(request)
+    video_durations = {m.url: m.duration for m in body.video_materials if m.duration}
+    video_paths = []
+    for m in body.video_materials:
+        if not m.url:
+            continue
+        if m.url not in video_durations and not timeline.is_image(m.url):
+            # only files under managed storage are opened, and probed
+            # directly: a dry run leaves no metadata sidecars behind
+            if not _is_managed_path(m.url):
+                raise HttpException(
+                    "",
+                    status_code=400,
+                    message=f"{request_id}: duration is required for materials outside the storage directory: {m.url}",
+                )
+            try:
+                video_durations[m.url] = ffmpeg.probe(m.url)["duration"]
+            except Exception as e:
+                logger.warning(f"failed to probe material: {m.url} => {str(e)}")
+                continue
+        video_paths.append(m.url)
+
+    video_timeline = timeline.plan(
+        video_paths=video_paths,
+        audio_duration=body.audio_duration,
+        video_aspect=body.video_aspect,
+        video_concat_mode=body.video_concat_mode,
+        video_transition_mode=body.video_transition_mode,
+        max_clip_duration=body.video_clip_duration,
+        video_durations=video_durations,
+    )
+    return utils.get_response(200, video_timeline.model_dump())
+
+
+def _is_managed_path(file_path: str) -> bool:
+    managed_dirs = [utils.storage_dir()]
+    material_directory = config.app.get("material_directory", "").strip()
+    if material_directory and os.path.isdir(material_directory):
+        managed_dirs.append(material_directory)
+
+    real_path = os.path.realpath(file_path)
+    for managed_dir in managed_dirs:
+        managed_dir = os.path.realpath(managed_dir)
+        try:
+            if os.path.commonpath([real_path, managed_dir]) == managed_dir:
+                return True
+        except ValueError:
+            # on another drive
+            continue
+    return False
+
+
 @router.get(
     "/tasks/{task_id}", response_model=TaskQueryResponse, summary="Query task status"
 )
@@ -23,3 +23,39 @@ TASK_STATE_PROCESSING = 4
 
 FILE_TYPE_VIDEOS = ["mp4", "mov", "mkv", "webm"]
 FILE_TYPE_IMAGES = ["jpg", "jpeg", "png", "bmp"]
+
+# Normalized material cache, see material.normalize_video
+NORMALIZED_VIDEO_FPS = 30
+NORMALIZED_VIDEO_PROFILE = "h264-crf18-k1-bf0"
+# seconds between forced keyframes, lets segments be cut on whole seconds by stream copy
+NORMALIZED_VIDEO_KEYFRAME_INTERVAL = 1
+
+# Length in seconds of the transitions between clips
+VIDEO_TRANSITION_DURATION = 1
+
+# Zoom of image materials per second (1 + speed * t), see video_effects.zoom_image
+IMAGE_ZOOM_SPEED = 0.03
+# Images are prepared to fit in a square of this size times their strongest zoom
+IMAGE_MAX_SIZE = 1920
+
+# Output settings of each render profile: resolution scale of the video aspect,
+# x264 preset and crf, frame rate. "standard" is the encoder's default quality
+RENDER_PROFILES = {
+    "draft": {"scale": 1 / 3, "preset": "ultrafast", "crf": 30, "fps": 15},
+    "standard": {"scale": 1, "preset": "medium", "crf": 23, "fps": 30},
+    "final": {"scale": 1, "preset": "slow", "crf": 18, "fps": 30},
+}
+
+# Request budget of each stock video API key as (requests, seconds)
+MATERIAL_API_RATE_LIMITS = {
+    "pexels_api_keys": (200, 3600),
+    "pixabay_api_keys": (100, 60),
+}
+# Providers whose X-RateLimit-* headers count the window above, the budget is
+# corrected from them at runtime. Pexels reports its monthly quota, which only
+# pauses a key once it is used up.
+MATERIAL_API_WINDOW_HEADERS = {"pixabay_api_keys"}
+# Retries of a search answered with 429 Too Many Requests
+MATERIAL_API_MAX_RETRIES = 3
+# Seconds between two scans of storage/cache_search for expired results
+SEARCH_CACHE_PRUNE_INTERVAL = 3600
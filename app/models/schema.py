@@ -25,6 +25,7 @@ class VideoTransitionMode(str, Enum):
     fade_out = "FadeOut"
     slide_in = "SlideIn"
     slide_out = "SlideOut"
+    crossfade = "Crossfade"
 
 
 class VideoAspect(str, Enum):
@@ -42,6 +43,12 @@ class VideoAspect(str, Enum):
         return 1080, 1920
 
 
+class RenderProfile(str, Enum):
+    draft = "draft"
+    standard = "standard"
+    final = "final"
+
+
 class _Config:
     arbitrary_types_allowed = True
 
@@ -76,6 +83,8 @@ class VideoParams(BaseModel):
     video_transition_mode: Optional[VideoTransitionMode] = None
     video_clip_duration: Optional[int] = 5
     video_count: Optional[int] = 1
+    # resolution, encoder settings and frame rate, see const.RENDER_PROFILES
+    render_profile: Optional[RenderProfile] = RenderProfile.standard.value
 
     video_source: Optional[str] = "pexels"
     video_materials: Optional[List[MaterialInfo]] = (
@@ -105,6 +114,46 @@ class VideoParams(BaseModel):
     paragraph_number: Optional[int] = 1
 
 
+class TimelineSegment(BaseModel):
+    """
+    One entry of the edit decision list: play `path` from `start` to `end`
+    (seconds within the material) with an optional transition.
+    """
+
+    path: str
+    start: float
+    end: float
+    transition: Optional[str] = None  # a VideoTransitionMode value
+    side: Optional[str] = ""  # left, right, top, bottom, used by slide transitions
+    # seconds played over the end of the previous segment (crossfade)
+    overlap: float = 0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Timeline(BaseModel):
+    """
+    Edit decision list of a combined video, produced by timeline.plan and
+    rendered by video.combine_videos / video.render_video.
+    """
+
+    video_aspect: VideoAspect = VideoAspect.portrait
+    fps: int = 30
+    duration: float = 0
+    segments: List[TimelineSegment] = []
+
+
+class TimelineRequest(BaseModel):
+    video_materials: List[MaterialInfo]  # url is the local file path
+    audio_duration: float
+    video_aspect: Optional[VideoAspect] = VideoAspect.portrait.value
+    video_concat_mode: Optional[VideoConcatMode] = VideoConcatMode.random.value
+    video_transition_mode: Optional[VideoTransitionMode] = None
+    video_clip_duration: Optional[int] = 5
+
+
 class SubtitleRequest(BaseModel):
     video_script: str
     video_language: Optional[str] = ""
@@ -273,6 +322,37 @@ class VideoTermsResponse(BaseResponse):
         }
 
 
+class TimelineResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "video_aspect": "9:16",
+                    "fps": 30,
+                    "duration": 8.5,
+                    "segments": [
+                        {
+                            "path": "/MoneyPrinterTurbo/storage/cache_videos/vid-0f2d4e7c.mp4",
+                            "start": 0.0,
+                            "end": 5.0,
+                            "transition": None,
+                            "side": "",
+                        },
+                        {
+                            "path": "/MoneyPrinterTurbo/storage/cache_videos/vid-8a91b3c2.mp4",
+                            "start": 5.0,
+                            "end": 8.5,
+                            "transition": None,
+                            "side": "",
+                        },
+                    ],
+                },
+            },
+        }
+
+
 class BgmRetrieveResponse(BaseResponse):
     class Config:
         json_schema_extra = {
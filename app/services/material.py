@@ -1,20 +1,68 @@
+import dataclasses
+import glob
+import hashlib
+import json
 import os
 import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from typing import List
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
 
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from PIL import Image
+from requests.adapters import HTTPAdapter
 
 from app.config import config
+from app.models import const
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import metadata
+from app.services.utils import ffmpeg, rate_limit
+from app.services.utils.file_cache import FileCache, Pins
 from app.utils import utils
 
-requested_count = 0
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
 
+_sessions = {}
+_sessions_lock = threading.Lock()
 
-def get_api_key(cfg_key: str):
+_key_schedulers = {}
+_key_schedulers_lock = threading.Lock()
+
+_video_cache = None
+_video_cache_lock = threading.Lock()
+
+_search_cache_pruned = 0.0
+_search_cache_prune_lock = threading.Lock()
+
+
+def _get_download_workers() -> int:
+    return max(1, int(config.app.get("download_workers", 4) or 1))
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    The shared session of the host of `url`. Its connection pool keeps
+    connections alive between the searches and downloads of all tasks.
+    """
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            pool_size = max(10, _get_download_workers())
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _sessions[host] = session
+        return session
+
+
+def _get_key_scheduler(cfg_key: str) -> rate_limit.KeyScheduler:
     api_keys = config.app.get(cfg_key)
     if not api_keys:
         raise ValueError(
@@ -22,13 +70,63 @@ def get_api_key(cfg_key: str):
             f"{utils.to_json(config.app)}"
         )
 
-    # if only one key is provided, return it
     if isinstance(api_keys, str):
-        return api_keys
+        api_keys = [api_keys]
+    with _key_schedulers_lock:
+        scheduler = _key_schedulers.get(cfg_key)
+        # rebuilt when the keys are changed in the config
+        if scheduler is None or scheduler.keys != list(api_keys):
+            capacity, period = const.MATERIAL_API_RATE_LIMITS.get(cfg_key, (100, 60))
+            scheduler = rate_limit.KeyScheduler(
+                api_keys,
+                capacity,
+                period,
+                headers_match_period=cfg_key in const.MATERIAL_API_WINDOW_HEADERS,
+            )
+            _key_schedulers[cfg_key] = scheduler
+        return scheduler
 
-    global requested_count
-    requested_count += 1
-    return api_keys[requested_count % len(api_keys)]
+
+def get_api_key(cfg_key: str):
+    """
+    The key of `cfg_key` with the most request budget left, waits when all
+    of them are rate limited.
+    """
+    return _get_key_scheduler(cfg_key).acquire()
+
+
+def _api_get(
+    scheduler: rate_limit.KeyScheduler, url: str, params: dict, key_param: str = ""
+) -> requests.Response:
+    """
+    GET a stock video API with a key of `scheduler`, sent as the `key_param`
+    query parameter or else as the Authorization header. The key budgets
+    follow the rate limit headers, a 429 response takes its key out of
+    rotation for a while and is retried with the next best key.
+    """
+    for attempt in range(const.MATERIAL_API_MAX_RETRIES + 1):
+        api_key = scheduler.acquire()
+        headers = {}
+        query = dict(params)
+        if key_param:
+            query[key_param] = api_key
+        else:
+            headers["Authorization"] = api_key
+        r = get_session(url).get(
+            f"{url}?{urlencode(query)}",
+            headers=headers,
+            proxies=config.proxy,
+            verify=False,
+            timeout=(30, 60),
+        )
+        scheduler.update(api_key, r.headers, r.status_code)
+        if r.status_code != 429:
+            return r
+        delay = scheduler.backoff(api_key, rate_limit.retry_after(r.headers))
+        logger.warning(
+            f"api key is rate limited, paused for {delay:.0f}s, attempt: {attempt + 1}"
+        )
+    return r
 
 
 def search_videos_pexels(
@@ -39,24 +137,15 @@ def search_videos_pexels(
     aspect = VideoAspect(video_aspect)
     video_orientation = aspect.name
     video_width, video_height = aspect.to_resolution()
-    api_key = get_api_key("pexels_api_keys")
-    headers = {
-        "Authorization": api_key,
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-    }
+    scheduler = _get_key_scheduler("pexels_api_keys")
     # Build URL
+    search_url = "https://api.pexels.com/videos/search"
     params = {"query": search_term, "per_page": 20, "orientation": video_orientation}
-    query_url = f"https://api.pexels.com/videos/search?{urlencode(params)}"
+    query_url = f"{search_url}?{urlencode(params)}"
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
-            query_url,
-            headers=headers,
-            proxies=config.proxy,
-            verify=False,
-            timeout=(30, 60),
-        )
+        r = _api_get(scheduler, search_url, params)
         response = r.json()
         video_items = []
         if "videos" not in response:
@@ -97,21 +186,19 @@ def search_videos_pixabay(
 
     video_width, video_height = aspect.to_resolution()
 
-    api_key = get_api_key("pixabay_api_keys")
+    scheduler = _get_key_scheduler("pixabay_api_keys")
     # Build URL
+    search_url = "https://pixabay.com/api/videos/"
     params = {
         "q": search_term,
         "video_type": "all",  # Accepted values: "all", "film", "animation"
         "per_page": 50,
-        "key": api_key,
     }
-    query_url = f"https://pixabay.com/api/videos/?{urlencode(params)}"
+    query_url = f"{search_url}?{urlencode(params)}"
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
-            query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
-        )
+        r = _api_get(scheduler, search_url, params, key_param="key")
         response = r.json()
         video_items = []
         if "hits" not in response:
@@ -144,54 +231,438 @@ def search_videos_pixabay(
     return []
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
+def _search_cache_path(
+    source: str, search_term: str, minimum_duration: int, video_aspect: VideoAspect
+) -> str:
+    key = f"{source}|{search_term}|{VideoAspect(video_aspect).value}|{minimum_duration}"
+    cache_dir = utils.storage_dir("cache_search", create=True)
+    return os.path.join(cache_dir, f"{source}-{utils.md5(key)}.json")
+
+
+def _prune_search_cache(ttl: int):
+    """
+    Delete cached search results (and temp files left by a crash) older than
+    `ttl`. Runs at most once per SEARCH_CACHE_PRUNE_INTERVAL, and only in one
+    thread at a time.
+    """
+    global _search_cache_pruned
+    now = time.time()
+    interval = min(ttl, const.SEARCH_CACHE_PRUNE_INTERVAL)
+    if not _search_cache_prune_lock.acquire(blocking=False):
+        return
+    try:
+        if now - _search_cache_pruned < interval:
+            return
+        _search_cache_pruned = now
+        removed = 0
+        with os.scandir(utils.storage_dir("cache_search", create=True)) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and now - entry.stat().st_mtime >= ttl:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    # removed by another process in the meantime
+                    continue
+        if removed:
+            logger.info(f"removed {removed} expired search cache files")
+    finally:
+        _search_cache_prune_lock.release()
+
+
+def search_videos(
+    source: str,
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    """
+    Search the provider `source` for `search_term`. Parsed results are cached
+    on disk per (provider, term, aspect, minimum duration) for
+    `search_cache_ttl` seconds, empty results (also failed searches) are not.
+    Expired files are deleted from time to time.
+    """
+    search = search_videos_pexels
+    if source == "pixabay":
+        search = search_videos_pixabay
+
+    ttl = config.app.get("search_cache_ttl", 86400)
+    if ttl:
+        _prune_search_cache(ttl)
+    cache_file = _search_cache_path(source, search_term, minimum_duration, video_aspect)
+    if ttl and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if time.time() - cached["created"] < ttl:
+                logger.info(f"using cached search results for '{search_term}'")
+                return [MaterialInfo(**item) for item in cached["items"]]
+        except Exception as e:
+            logger.warning(f"invalid search cache: {cache_file} => {str(e)}")
+
+    video_items = search(
+        search_term=search_term,
+        minimum_duration=minimum_duration,
+        video_aspect=video_aspect,
+    )
+    if ttl and video_items:
+        temp_file = ffmpeg.temp_path(cache_file)
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "created": time.time(),
+                        "items": [dataclasses.asdict(item) for item in video_items],
+                    },
+                    f,
+                )
+            os.replace(temp_file, cache_file)
+        except Exception as e:
+            logger.warning(f"failed to save search cache: {cache_file} => {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+    return video_items
+
+
+def video_cache() -> FileCache:
+    """
+    The LRU store of storage/cache_videos and storage/normalized_videos,
+    bounded together by cache_videos_max_gb (0 keeps every file). Metadata
+    sidecars and download parts count towards it, parts of downloads
+    abandoned for a day are deleted. Materials saved to a custom
+    material_directory are not managed.
+    """
+    global _video_cache
+    with _video_cache_lock:
+        if _video_cache is None:
+            max_gb = float(config.app.get("cache_videos_max_gb", 0) or 0)
+            _video_cache = FileCache(
+                utils.storage_dir(create=True),
+                max_bytes=int(max_gb * 1024**3),
+                patterns=["cache_videos/vid-*.mp4", "normalized_videos/*.mp4"],
+                on_evict=_remove_derived_files,
+                sidecars=[".meta.json", ".validator"],
+                temp_patterns=["cache_videos/vid-*.mp4.part"],
+            )
+            # left by downloads of earlier runs
+            _video_cache.remove_stale()
+        return _video_cache
+
+
+def _remove_derived_files(video_path: str):
+    # the normalized copies of a material
+    if video_path.endswith(".part"):
+        return
+    material_id, _ = os.path.splitext(os.path.basename(video_path))
+    normalized_dir = utils.storage_dir("normalized_videos")
+    for file in glob.glob(os.path.join(normalized_dir, f"{material_id}-*")):
+        _remove_file(file)
+
+
+@contextmanager
+def pin_videos(video_paths: List[str] = ()):
+    """
+    Keep the cached materials of a running task from being evicted. Yields
+    the Pins, pass them to download_videos to pin each video as it is saved.
+    """
+    with video_cache().pin(video_paths) as pins:
+        yield pins
+
+
+def save_video(video_url: str, save_dir: str = "", pins: Pins = None) -> str:
     if not save_dir:
         save_dir = utils.storage_dir("cache_videos")
 
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
 
+    cache = None
+    if os.path.abspath(save_dir) == os.path.abspath(utils.storage_dir("cache_videos")):
+        cache = video_cache()
+
     url_without_query = video_url.split("?")[0]
     url_hash = utils.md5(url_without_query)
     video_id = f"vid-{url_hash}"
     video_path = f"{save_dir}/{video_id}.mp4"
+    if cache and pins:
+        # before the file is looked up, so a hit cannot be evicted until the
+        # task releases it
+        pins.add(video_path)
 
     # if video already exists, return the path
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
-        logger.info(f"video already exists: {video_path}")
-        return video_path
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
+        if not cache or cache.hit(video_path):
+            logger.info(f"video already exists: {video_path}")
+            return video_path
 
     # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+    with _download_lock(video_path):
+        if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+            return video_path
+        part_path = f"{video_path}.part"
+        _download(video_url, part_path)
 
-    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+        # verify before moving into place, readers never see a partial file
         try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
-                return video_path
-        except Exception as e:
-            try:
-                os.remove(video_path)
-            except Exception:
-                pass
-            logger.warning(f"invalid video file: {video_path} => {str(e)}")
-    return ""
+            info = ffmpeg.probe(part_path)
+        except Exception:
+            info = {}
+        if info.get("duration", 0) <= 0 or info.get("fps", 0) <= 0:
+            _remove_file(part_path)
+            _remove_file(_validator_path(part_path))
+            logger.warning(f"invalid video file: {video_url}")
+            return ""
+        os.replace(part_path, video_path)
+        # the rename keeps size and mtime, the probe is the metadata sidecar
+        # used by later stages
+        metadata.record(video_path, info)
+
+    if cache:
+        cache.add(video_path)
+    return video_path
+
+
+# file path -> [lock, number of threads holding or waiting for it]
+_download_locks = {}
+_download_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _download_lock(file_path: str):
+    # one download per file at a time, concurrent tasks may want the same one;
+    # the entry is dropped once no thread uses it, so the dict stays small
+    with _download_locks_lock:
+        entry = _download_locks.setdefault(file_path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _download_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _download_locks[file_path]
+
+
+def _download(url: str, part_path: str, chunk_size: int = 1024 * 1024):
+    """
+    Stream `url` into `part_path` chunk by chunk. A part left by an
+    interrupted download is resumed with a Range request guarded by If-Range,
+    so a file changed on the server is fetched again from the start instead
+    of being appended to. Raises on network errors (keeping the part for the
+    next attempt) and when the body is shorter than announced.
+    """
+    validator_path = _validator_path(part_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = ""
+    if offset:
+        try:
+            with open(validator_path, "r", encoding="utf-8") as f:
+                validator = f.read().strip()
+        except OSError:
+            pass
+        if not validator:
+            # cannot tell whether the part is still a prefix of the file
+            offset = 0
+    headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+    with get_session(url).get(
+        url,
+        headers=headers,
+        proxies=config.proxy,
+        verify=False,
+        timeout=(60, 240),
+        stream=True,
+    ) as r:
+        if offset and r.status_code == 416:
+            # nothing left to fetch, the part is complete
+            _remove_file(validator_path)
+            return
+        r.raise_for_status()
+        content_range = r.headers.get("Content-Range", "")
+        if r.status_code == 206 and content_range.startswith(f"bytes {offset}-"):
+            logger.info(f"resuming download at {offset} bytes: {url}")
+            mode = "ab"
+        else:
+            # a 200 is the whole (possibly changed) file
+            offset = 0
+            mode = "wb"
+            _save_validator(validator_path, r.headers)
+        expected = int(r.headers.get("Content-Length", 0) or 0)
+
+        received = 0
+        with open(part_path, mode) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                received += len(chunk)
+
+    if expected and received < expected:
+        raise IOError(
+            f"incomplete download, received {offset + received} of "
+            f"{offset + expected} bytes: {url}"
+        )
+    _remove_file(validator_path)
+
+
+def _validator_path(part_path: str) -> str:
+    # the ETag or Last-Modified of the response a part was started from
+    return f"{part_path}.validator"
+
+
+def _save_validator(validator_path: str, headers):
+    # weak ETags cannot be used with If-Range, Last-Modified can
+    validator = headers.get("ETag", "")
+    if not validator or validator.startswith("W/"):
+        validator = headers.get("Last-Modified", "")
+    if not validator:
+        _remove_file(validator_path)
+        return
+    with open(validator_path, "w", encoding="utf-8") as f:
+        f.write(validator)
+
+
+def _remove_file(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"failed to remove file: {file_path} => {str(e)}")
+
+
+def normalized_codec_args() -> List[str]:
+    """
+    Encoder settings of the normalized cache, also used for segments that
+    have to be re-encoded before they can be joined with normalized files.
+    """
+    interval = const.NORMALIZED_VIDEO_KEYFRAME_INTERVAL
+    return [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-crf",
+        "18",
+        "-pix_fmt",
+        "yuv420p",
+        # without B-frames packets are stored in display order, so the
+        # concat demuxer's outpoint cuts exactly on a stream copy
+        "-bf",
+        "0",
+        "-force_key_frames",
+        f"expr:gte(t,n_forced*{interval})",
+    ]
+
+
+def is_normalized_video(video_path: str) -> bool:
+    normalized_dir = utils.storage_dir("normalized_videos")
+    return os.path.dirname(os.path.abspath(video_path)) == normalized_dir
+
+
+def normalize_video(
+    video_path: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    fps: int = const.NORMALIZED_VIDEO_FPS,
+    pins: Pins = None,
+) -> str:
+    """
+    Return a copy of `video_path` scaled and letterboxed to the resolution of
+    `video_aspect` and re-timed to `fps`, transcoding it on first use.
+
+    Normalized files are shared by all tasks and keyed by the material id (the
+    md5 of the download url), the aspect, the fps and the codec profile. They
+    count towards the video cache budget, `pins` keeps the copy of a running
+    task. Falls back to the original path if the transcode fails.
+    """
+    aspect = VideoAspect(video_aspect)
+    video_width, video_height = aspect.to_resolution()
+
+    # downloaded materials are named vid-<md5 of url>.mp4, reuse that id
+    material_id, _ = os.path.splitext(os.path.basename(video_path))
+    if not material_id.startswith("vid-"):
+        material_id = f"local-{utils.md5(os.path.abspath(video_path))}"
+
+    save_dir = utils.storage_dir("normalized_videos", create=True)
+    profile = const.NORMALIZED_VIDEO_PROFILE
+    normalized_path = os.path.join(
+        save_dir,
+        f"{material_id}-{video_width}x{video_height}-{fps}-{profile}.mp4",
+    )
+    cache = video_cache()
+    if pins:
+        pins.add(normalized_path)
+    if os.path.exists(normalized_path) and os.path.getsize(normalized_path) > 0:
+        if os.path.getmtime(normalized_path) >= os.path.getmtime(video_path):
+            if cache.hit(normalized_path):
+                return normalized_path
+
+    logger.info(f"normalizing video: {video_path} => {normalized_path}")
+    video_filter = (
+        f"scale={video_width}:{video_height}:force_original_aspect_ratio=decrease:force_divisible_by=2,"
+        f"pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2:color=black,"
+        f"setsar=1,fps={fps}"
+    )
+    temp_file = ffmpeg.temp_path(normalized_path)
+    ok = ffmpeg.run(
+        [
+            "-i",
+            video_path,
+            "-an",
+            "-vf",
+            video_filter,
+            *normalized_codec_args(),
+            "-movflags",
+            "+faststart",
+            temp_file,
+        ]
+    )
+    if not ok:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        logger.warning(f"failed to normalize video, use the original: {video_path}")
+        return video_path
+
+    os.replace(temp_file, normalized_path)
+    cache.add(normalized_path)
+    return normalized_path
+
+
+def _file_md5(file_path: str) -> str:
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prepare_image(image_path: str, max_size: int) -> str:
+    """
+    Return a copy of `image_path` downscaled to fit in `max_size` x `max_size`,
+    or the image itself if it is already small enough. Copies are shared by
+    all tasks and keyed by the md5 of the image content, so uploading the same
+    image again reuses them. Falls back to the original path on failure.
+    """
+    try:
+        with Image.open(image_path) as image:
+            if max(image.size) <= max_size:
+                return image_path
+
+            save_dir = utils.storage_dir("prepared_images", create=True)
+            prepared_path = os.path.join(
+                save_dir, f"img-{_file_md5(image_path)}-{max_size}.jpg"
+            )
+            if os.path.exists(prepared_path) and os.path.getsize(prepared_path) > 0:
+                return prepared_path
+
+            logger.info(f"preparing image: {image_path} => {prepared_path}")
+            image = image.convert("RGB")
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            temp_file = ffmpeg.temp_path(prepared_path)
+            image.save(temp_file, format="JPEG", quality=95)
+        os.replace(temp_file, prepared_path)
+        return prepared_path
+    except Exception as e:
+        logger.warning(f"failed to prepare image, use the original: {str(e)}")
+        return image_path
 
 
 def download_videos(
@@ -203,22 +674,29 @@ def download_videos(
     audio_duration: float = 0.0,
     max_clip_duration: int = 5,
     progress_callback=None,
+    pins: Pins = None,
 ) -> List[str]:
     valid_video_items = []
     valid_video_urls = []
     found_duration = 0.0
-    search_videos = search_videos_pexels
-    if source == "pixabay":
-        search_videos = search_videos_pixabay
 
     if progress_callback:
         progress_callback(55, "Searching Videos")
-    for search_term in search_terms:
-        video_items = search_videos(
+
+    # all terms at once, the results are merged in the order of the terms
+    def search(search_term):
+        return search_videos(
+            source=source,
             search_term=search_term,
             minimum_duration=max_clip_duration,
             video_aspect=video_aspect,
         )
+
+    workers = max(1, min(len(search_terms), _get_download_workers()))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        search_results = list(executor.map(search, search_terms))
+
+    for search_term, video_items in zip(search_terms, search_results):
         logger.info(f"found {len(video_items)} videos for '{search_term}'")
 
         for item in video_items:
@@ -241,27 +719,59 @@ def download_videos(
     if video_contact_mode.value == VideoConcatMode.random.value:
         random.shuffle(valid_video_items)
 
+    # Download up to `workers` candidates at a time, in the order of the
+    # list. A new download is only started while the saved videos and the
+    # running downloads (if they succeed) do not cover the audio yet.
+    workers = _get_download_workers()
+    candidates = iter(enumerate(valid_video_items))
+    saved_videos = {}
     total_duration = 0.0
-    for index, item in enumerate(valid_video_items):
-        try:
-            if progress_callback:
-                progress_callback(60, "Downloading Videos", index + 1)
-            logger.info(f"downloading video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
+    attempted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+
+        def clip_seconds(item: MaterialInfo) -> float:
+            return min(max_clip_duration, item.duration)
+
+        def submit_more():
+            expected = total_duration + sum(
+                clip_seconds(item) for _, item in running.values()
             )
-            if saved_video_path:
-                logger.info(f"video saved: {saved_video_path}")
-                video_paths.append(saved_video_path)
-                seconds = min(max_clip_duration, item.duration)
-                total_duration += seconds
-                if total_duration > audio_duration:
-                    logger.info(
-                        f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
+            while len(running) < workers and expected <= audio_duration:
+                index, item = next(candidates, (None, None))
+                if item is None:
+                    return
+                logger.info(f"downloading video: {item.url}")
+                future = executor.submit(save_video, item.url, material_directory, pins)
+                running[future] = (index, item)
+                expected += clip_seconds(item)
+
+        submit_more()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item = running.pop(future)
+                attempted += 1
+                if progress_callback:
+                    progress_callback(60, "Downloading Videos", attempted)
+                try:
+                    saved_video_path = future.result()
+                except Exception as e:
+                    logger.error(
+                        f"failed to download video: {utils.to_json(item)} => {str(e)}"
                     )
-                    break
-        except Exception as e:
-            logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+                    continue
+                if saved_video_path:
+                    logger.info(f"video saved: {saved_video_path}")
+                    saved_videos[index] = saved_video_path
+                    total_duration += clip_seconds(item)
+            submit_more()
+
+    if total_duration > audio_duration:
+        logger.info(
+            f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
+        )
+    video_paths = [saved_videos[index] for index in sorted(saved_videos)]
     logger.success(f"downloaded {len(video_paths)} videos")
     return video_paths
 
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+from typing import List
+
+from loguru import logger
+
+from app.services.utils import ffmpeg
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _sidecar_path(file_path: str) -> str:
+    return f"{file_path}.meta.json"
+
+
+def _file_stat(file_path: str):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+
+def _load(file_path: str) -> dict:
+    try:
+        size, mtime = _file_stat(file_path)
+    except OSError:
+        return {}
+    with _lock:
+        info = _cache.get(file_path)
+    if info and info["size"] == size and info["mtime"] == mtime:
+        return info
+
+    sidecar = _sidecar_path(file_path)
+    if os.path.isfile(sidecar):
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info.get("size") == size and info.get("mtime") == mtime:
+                with _lock:
+                    _cache[file_path] = info
+                return info
+        except Exception as e:
+            logger.warning(f"invalid metadata file: {sidecar} => {str(e)}")
+    return {}
+
+
+def _save(file_path: str, info: dict):
+    with _lock:
+        _cache[file_path] = info
+
+    sidecar = _sidecar_path(file_path)
+    temp_file = ffmpeg.temp_path(sidecar)
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        os.replace(temp_file, sidecar)
+    except Exception as e:
+        # read-only material directories still get the in-process cache
+        logger.warning(f"failed to save metadata file: {sidecar} => {str(e)}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def get_info(file_path: str) -> dict:
+    """
+    Metadata of a media file: duration, fps, width, height, codec and
+    whether it has video/audio. Read from the `<file>.meta.json` sidecar,
+    which is created by a header parse on first use and refreshed when the
+    file size or mtime changes. Returns {} if the file cannot be parsed.
+    """
+    info = _load(file_path)
+    if info:
+        return info
+
+    try:
+        info = ffmpeg.probe(file_path)
+    except Exception as e:
+        logger.warning(f"failed to probe media file: {file_path} => {str(e)}")
+        return {}
+    return record(file_path, info)
+
+
+def record(file_path: str, info: dict) -> dict:
+    """
+    Store the result of an ffmpeg.probe() of `file_path` as its metadata,
+    for callers that already parsed the file (e.g. before renaming it into
+    place). Returns {} if the file is gone.
+    """
+    try:
+        size, mtime = _file_stat(file_path)
+    except OSError:
+        return {}
+    info = {**info, "size": size, "mtime": mtime, "keyframes": None}
+    _save(file_path, info)
+    return info
+
+
+def get_duration(file_path: str) -> float:
+    return get_info(file_path).get("duration", 0)
+
+
+def get_keyframes(file_path: str) -> List[float]:
+    """
+    Keyframe timestamps of the first video stream, listed on first use and
+    stored in the sidecar next to the other metadata.
+    """
+    info = get_info(file_path)
+    if not info:
+        return []
+    if info.get("keyframes") is None:
+        try:
+            keyframes = ffmpeg.keyframes(file_path)
+        except Exception as e:
+            logger.warning(f"failed to list keyframes: {file_path} => {str(e)}")
+            return []
+        info = {**info, "keyframes": keyframes}
+        _save(file_path, info)
+    return info["keyframes"]
+
+
+def is_keyframe(file_path: str, seconds: float) -> bool:
+    return any(abs(k - seconds) < 0.001 for k in get_keyframes(file_path))
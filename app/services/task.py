@@ -1,14 +1,18 @@
+import glob
 import math
+import multiprocessing
 import os.path
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import path
+from typing import List
 
 from loguru import logger
 
 from app.config import config
 from app.models import const
-from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
+from app.models.schema import RenderProfile, Timeline, VideoConcatMode, VideoParams
+from app.services import llm, material, subtitle, timeline, video, voice
 from app.services import state as sm
 from app.utils import utils
 
@@ -70,6 +74,16 @@ def save_script_data(task_id, video_script, video_terms, params):
         f.write(utils.to_json(script_data))
 
 
+def save_params(params: VideoParams, file_path: str):
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(params.model_dump_json(indent=4))
+
+
+def load_params(file_path: str) -> VideoParams:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return VideoParams.model_validate_json(f.read())
+
+
 def generate_audio(task_id, params, video_script):
     logger.info("\n\n## generating audio")
     audio_file = path.join(utils.task_dir(task_id), "audio.mp3")
@@ -124,12 +138,14 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
 
 
 def get_video_materials(
-    task_id, params, video_terms, audio_duration, progress_callback=None
+    task_id, params, video_terms, audio_duration, progress_callback=None, pins=None
 ):
     if params.video_source == "local":
         logger.info("\n\n## preprocess local materials")
         materials = video.preprocess_video(
-            materials=params.video_materials, clip_duration=params.video_clip_duration
+            materials=params.video_materials,
+            clip_duration=params.video_clip_duration,
+            progress_callback=progress_callback,
         )
         if not materials:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -149,6 +165,7 @@ def get_video_materials(
             audio_duration=audio_duration * params.video_count,
             max_clip_duration=params.video_clip_duration,
             progress_callback=progress_callback,
+            pins=pins,
         )
         if not downloaded_videos:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -159,6 +176,87 @@ def get_video_materials(
         return downloaded_videos
 
 
+def _get_variant_workers() -> int:
+    workers = config.app.get("variant_workers", 0)
+    if workers == "auto":
+        return os.cpu_count() or 1
+    return int(workers or 0)
+
+
+def _render_variant(
+    index: int,
+    video_timeline: Timeline,
+    params: VideoParams,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    video_concat_mode: VideoConcatMode,
+    task_dir: str,
+    progress_callback=None,
+    update_progress=None,
+):
+    """
+    Render variant `index` of a task, returns the final and combined video
+    paths (the combined path is empty when it is not kept). Runs in a worker
+    process when variants are rendered concurrently.
+    """
+    combined_video_path = path.join(task_dir, f"combined-{index}.mp4")
+    final_video_path = path.join(task_dir, f"final-{index}.mp4")
+
+    if config.app.get("single_pass_render", False):
+        if not config.app.get("keep_combined_video", False):
+            combined_video_path = ""
+        logger.info(f"\n\n## rendering video: {index} => {final_video_path}")
+        if progress_callback:
+            progress_callback(55, "Combining Videos", index - 1)
+        video.render_video(
+            video_paths=downloaded_videos,
+            audio_path=audio_file,
+            subtitle_path=subtitle_path,
+            output_file=final_video_path,
+            params=params,
+            video_concat_mode=video_concat_mode,
+            combined_video_path=combined_video_path,
+            progress_callback=progress_callback,
+            video_timeline=video_timeline,
+        )
+        if update_progress:
+            update_progress(1)
+        return final_video_path, combined_video_path
+
+    logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
+    if progress_callback:
+        progress_callback(55, "Combining Videos", index - 1)
+    video.combine_videos(
+        combined_video_path=combined_video_path,
+        video_paths=downloaded_videos,
+        audio_file=audio_file,
+        video_aspect=params.video_aspect,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=params.video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+        threads=params.n_threads,
+        progress_callback=progress_callback,
+        video_timeline=video_timeline,
+        render_profile=params.render_profile,
+    )
+    if update_progress:
+        update_progress(0.5)
+
+    logger.info(f"\n\n## generating video: {index} => {final_video_path}")
+    video.generate_video(
+        video_path=combined_video_path,
+        audio_path=audio_file,
+        subtitle_path=subtitle_path,
+        output_file=final_video_path,
+        params=params,
+        progress_callback=progress_callback,
+    )
+    if update_progress:
+        update_progress(0.5)
+    return final_video_path, combined_video_path
+
+
 def generate_final_videos(
     task_id,
     params: VideoParams,
@@ -166,57 +264,119 @@ def generate_final_videos(
     audio_file,
     subtitle_path,
     progress_callback=None,
+    video_timelines: List[Timeline] = None,
+    variant_params: List[VideoParams] = None,
+    pins=None,
 ):
-    final_video_paths = []
-    combined_video_paths = []
+    """
+    Render `params.video_count` variants, planned from `downloaded_videos`
+    unless the timelines (and params) of an earlier render are passed in.
+    `pins` keeps the cached files the variants are rendered from.
+    """
     video_concat_mode = (
         params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
     )
-    video_transition_mode = params.video_transition_mode
-
-    _progress = 50
-    for i in range(params.video_count):
-        index = i + 1
-        combined_video_path = path.join(
-            utils.task_dir(task_id), f"combined-{index}.mp4"
+    task_dir = utils.task_dir(task_id)
+
+    # plan every variant up front, so their materials can be prepared together
+    if not video_timelines:
+        audio_duration = timeline.get_duration(audio_file)
+        video_timelines = []
+        variant_params = []
+        for i in range(params.video_count):
+            video_timeline = timeline.plan(
+                video_paths=downloaded_videos,
+                audio_duration=audio_duration,
+                video_aspect=params.video_aspect,
+                video_concat_mode=video_concat_mode,
+                video_transition_mode=params.video_transition_mode,
+                max_clip_duration=params.video_clip_duration,
+            )
+            timeline.save(video_timeline, path.join(task_dir, f"timeline-{i + 1}.json"))
+            video_timelines.append(video_timeline)
+            # the background music is picked here and saved with the params,
+            # so promote_to_final renders the variant again exactly
+            bgm_file = video.get_bgm_file(params.bgm_type, params.bgm_file)
+            video_params = params.model_copy(update={"bgm_file": bgm_file})
+            save_params(video_params, path.join(task_dir, f"params-{i + 1}.json"))
+            variant_params.append(video_params)
+    video_count = len(video_timelines)
+    variant_params = variant_params or [params] * video_count
+
+    workers = min(_get_variant_workers(), video_count)
+    if video.uses_normalized_materials(params.render_profile):
+        # transcode each source once for all variants (when the normalized
+        # cache is enabled), every variant then reads the same pinned files
+        video_timelines = video.normalize_timelines(
+            video_timelines, workers=max(workers, 1), pins=pins
         )
-        logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
 
-        if progress_callback:
-            progress_callback(55, "Combining Videos", i)
-        video.combine_videos(
-            combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
-            audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            video_transition_mode=video_transition_mode,
-            max_clip_duration=params.video_clip_duration,
-            threads=params.n_threads,
-            progress_callback=progress_callback,
-        )
+    _progress = 50
 
-        _progress += 50 / params.video_count / 2
+    def update_progress(fraction):
+        nonlocal _progress
+        _progress += 50 / video_count * fraction
         sm.state.update_task(task_id, progress=_progress)
 
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
-
-        logger.info(f"\n\n## generating video: {index} => {final_video_path}")
-        video.generate_video(
-            video_path=combined_video_path,
-            audio_path=audio_file,
-            subtitle_path=subtitle_path,
-            output_file=final_video_path,
-            params=params,
+    results = {}
+    pending = list(range(1, video_count + 1))
+    if workers > 1:
+        logger.info(f"rendering {len(pending)} videos with {workers} workers")
+        if progress_callback:
+            progress_callback(55, "Combining Videos", 0)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _render_variant,
+                        index,
+                        video_timelines[index - 1],
+                        variant_params[index - 1],
+                        downloaded_videos,
+                        audio_file,
+                        subtitle_path,
+                        video_concat_mode,
+                        task_dir,
+                    ): index
+                    for index in pending
+                }
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        results[index] = future.result()
+                        update_progress(1)
+                    except Exception as e:
+                        logger.error(f"failed to render video {index}: {repr(e)}")
+        except Exception as e:
+            logger.error(f"failed to render videos in parallel: {repr(e)}")
+        pending = [index for index in pending if index not in results]
+        if pending:
+            logger.warning(f"rendering videos {pending} one by one")
+
+    for index in pending:
+        results[index] = _render_variant(
+            index,
+            video_timelines[index - 1],
+            variant_params[index - 1],
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            video_concat_mode,
+            task_dir,
             progress_callback=progress_callback,
+            update_progress=update_progress,
         )
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
-
+    final_video_paths = []
+    combined_video_paths = []
+    for index in sorted(results):
+        final_video_path, combined_video_path = results[index]
         final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
-
+        if combined_video_path:
+            combined_video_paths.append(combined_video_path)
     return final_video_paths, combined_video_paths
 
 
@@ -303,36 +463,46 @@ def start(task_id, params: VideoParams, stop_at: str = "video", progress_callbac
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
 
     # 5. Get video materials
-    if progress_callback:
-        progress_callback(40, "Getting Video Materials")
-    downloaded_videos = get_video_materials(
-        task_id,
-        params,
-        video_terms,
-        audio_duration,
-        progress_callback=progress_callback,
-    )
-    if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
-
-    if stop_at == "materials":
-        sm.state.update_task(
+    # cached materials are pinned as soon as they are saved, until the final
+    # videos are rendered from them
+    with material.pin_videos() as pins:
+        if progress_callback:
+            progress_callback(40, "Getting Video Materials")
+        downloaded_videos = get_video_materials(
             task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            materials=downloaded_videos,
+            params,
+            video_terms,
+            audio_duration,
+            progress_callback=progress_callback,
+            pins=pins,
         )
-        return {"materials": downloaded_videos}
+        if not downloaded_videos:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+        if stop_at == "materials":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                materials=downloaded_videos,
+            )
+            return {"materials": downloaded_videos}
 
-    # 6. Generate final videos
-    if progress_callback:
-        progress_callback(50, "Generating Final Videos")
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path, progress_callback
-    )
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+
+        # 6. Generate final videos
+        if progress_callback:
+            progress_callback(50, "Generating Final Videos")
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id,
+            params,
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            progress_callback,
+            pins=pins,
+        )
 
     if not final_video_paths:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -360,6 +530,80 @@ def start(task_id, params: VideoParams, stop_at: str = "video", progress_callbac
     return kwargs
 
 
+def promote_to_final(task_id, progress_callback=None):
+    """
+    Render the videos of a finished task again with the final profile, e.g.
+    after checking a draft. The planned timelines, params (background music
+    included), narration and subtitles of the task are reused, so the result
+    is the draft at full quality.
+    """
+    task_dir = utils.task_dir(task_id)
+    audio_file = path.join(task_dir, "audio.mp3")
+    timeline_files = glob.glob(path.join(task_dir, "timeline-*.json"))
+
+    def file_index(file):
+        return int(re.search(r"-(\d+)\.json$", file).group(1))
+
+    timeline_files = sorted(timeline_files, key=file_index)
+    params_files = [
+        path.join(task_dir, f"params-{file_index(file)}.json")
+        for file in timeline_files
+    ]
+    if (
+        not timeline_files
+        or not path.exists(audio_file)
+        or not all(path.exists(file) for file in params_files)
+    ):
+        logger.error(f"no timeline, params or audio to promote in task: {task_id}")
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return
+
+    video_timelines = [timeline.load(file) for file in timeline_files]
+    variant_params = [
+        load_params(file).model_copy(update={"render_profile": RenderProfile.final})
+        for file in params_files
+    ]
+    params = variant_params[0]
+    subtitle_path = path.join(task_dir, "subtitle.srt")
+    if not params.subtitle_enabled or not path.exists(subtitle_path):
+        subtitle_path = ""
+    downloaded_videos = list(
+        dict.fromkeys(s.path for t in video_timelines for s in t.segments)
+    )
+    logger.info(f"promoting task {task_id} to final, {len(video_timelines)} videos")
+
+    task = sm.state.get_task(task_id) or {}
+    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+    if progress_callback:
+        progress_callback(50, "Generating Final Videos")
+    with material.pin_videos(downloaded_videos) as pins:
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id,
+            params,
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            progress_callback,
+            video_timelines=video_timelines,
+            variant_params=variant_params,
+            pins=pins,
+        )
+    if not final_video_paths:
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return
+
+    logger.success(f"task {task_id} promoted to final")
+    kwargs = {k: v for k, v in task.items() if k not in ("state", "progress")}
+    kwargs["videos"] = final_video_paths
+    kwargs["combined_videos"] = combined_video_paths
+    sm.state.update_task(
+        task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
+    )
+    if progress_callback:
+        progress_callback(100, "Generating Final Videos")
+    return kwargs
+
+
 if __name__ == "__main__":
     task_id = "task_id"
     params = VideoParams(
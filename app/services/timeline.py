@@ -0,0 +1,143 @@
+import random
+from typing import Dict, List
+
+from loguru import logger
+
+from app.models import const
+from app.models.schema import (
+    Timeline,
+    TimelineSegment,
+    VideoAspect,
+    VideoConcatMode,
+    VideoTransitionMode,
+)
+from app.services import metadata
+from app.utils import utils
+
+
+def get_duration(file_path: str) -> float:
+    return metadata.get_duration(file_path)
+
+
+def is_image(file_path: str) -> bool:
+    return utils.parse_extension(file_path) in const.FILE_TYPE_IMAGES
+
+
+def _pick_transition(video_transition_mode: VideoTransitionMode):
+    if (
+        not video_transition_mode
+        or video_transition_mode.value == VideoTransitionMode.none.value
+    ):
+        return None, ""
+
+    shuffle_side = random.choice(["left", "right", "top", "bottom"])
+    if video_transition_mode.value == VideoTransitionMode.shuffle.value:
+        transition = random.choice(
+            [
+                VideoTransitionMode.fade_in,
+                VideoTransitionMode.fade_out,
+                VideoTransitionMode.slide_in,
+                VideoTransitionMode.slide_out,
+            ]
+        )
+        return transition.value, shuffle_side
+    return video_transition_mode.value, shuffle_side
+
+
+def plan(
+    video_paths: List[str],
+    audio_duration: float,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    video_durations: Dict[str, float] = None,
+) -> Timeline:
+    """
+    Decide which part of which material is played, in order, until
+    `audio_duration` is covered. Only durations are needed: they are taken
+    from `video_durations` when given, otherwise from the metadata index.
+    No frames are decoded.
+    """
+    video_durations = video_durations or {}
+    video_concat_mode = VideoConcatMode(video_concat_mode)
+    if video_transition_mode:
+        video_transition_mode = VideoTransitionMode(video_transition_mode)
+
+    # Required duration of each clip
+    req_dur = max_clip_duration
+    logger.info(f"each clip will be maximum {req_dur} seconds long")
+
+    raw_segments = []
+    for video_path in video_paths:
+        if is_image(video_path):
+            # images are shown for one clip, zooming in
+            clip_duration = max_clip_duration
+        else:
+            clip_duration = video_durations.get(video_path) or get_duration(video_path)
+        start_time = 0
+
+        while start_time < clip_duration:
+            end_time = min(start_time + max_clip_duration, clip_duration)
+            raw_segments.append((video_path, start_time, end_time))
+            start_time = end_time
+            if video_concat_mode.value == VideoConcatMode.sequential.value:
+                break
+
+    # random video_paths order
+    if video_concat_mode.value == VideoConcatMode.random.value:
+        random.shuffle(raw_segments)
+
+    segments = []
+    video_duration = 0
+    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
+    while video_duration < audio_duration and raw_segments:
+        for video_path, start_time, end_time in raw_segments:
+            transition, side = _pick_transition(video_transition_mode)
+            # A crossfade plays the start of the clip over the end of the
+            # previous one, that part does not add to the video duration
+            overlap = 0
+            if transition == VideoTransitionMode.crossfade.value and segments:
+                previous = segments[-1]
+                overlap = min(
+                    const.VIDEO_TRANSITION_DURATION,
+                    (previous.duration - previous.overlap) / 2,
+                    (end_time - start_time) / 2,
+                )
+
+            # Check if clip is longer than the remaining audio
+            if (audio_duration - video_duration + overlap) < end_time - start_time:
+                end_time = start_time + (audio_duration - video_duration + overlap)
+            # Only shorten clips if the calculated clip length (req_dur) is shorter than the actual clip to prevent still image
+            elif req_dur < end_time - start_time:
+                end_time = start_time + req_dur
+
+            segments.append(
+                TimelineSegment(
+                    path=video_path,
+                    start=start_time,
+                    end=end_time,
+                    transition=transition,
+                    side=side,
+                    overlap=overlap,
+                )
+            )
+            video_duration += end_time - start_time - overlap
+            if video_duration >= audio_duration:
+                break
+
+    return Timeline(
+        video_aspect=VideoAspect(video_aspect),
+        duration=video_duration,
+        segments=segments,
+    )
+
+
+def save(timeline: Timeline, file_path: str):
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(timeline.model_dump_json(indent=4))
+
+
+def load(file_path: str) -> Timeline:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return Timeline.model_validate_json(f.read())
@@ -0,0 +1,122 @@
+from typing import List, Tuple
+
+from PIL import ImageColor
+
+STYLE_FIELDS = [
+    "Name",
+    "Fontname",
+    "Fontsize",
+    "PrimaryColour",
+    "SecondaryColour",
+    "OutlineColour",
+    "BackColour",
+    "Bold",
+    "Italic",
+    "Underline",
+    "StrikeOut",
+    "ScaleX",
+    "ScaleY",
+    "Spacing",
+    "Angle",
+    "BorderStyle",
+    "Outline",
+    "Shadow",
+    "Alignment",
+    "MarginL",
+    "MarginR",
+    "MarginV",
+    "Encoding",
+]
+
+DEFAULT_STYLE = {
+    "Name": "Default",
+    "Fontname": "Arial",
+    "Fontsize": 60,
+    "PrimaryColour": "&H00FFFFFF",
+    "SecondaryColour": "&H00FFFFFF",
+    "OutlineColour": "&H00000000",
+    "BackColour": "&H00000000",
+    "Bold": 0,
+    "Italic": 0,
+    "Underline": 0,
+    "StrikeOut": 0,
+    "ScaleX": 100,
+    "ScaleY": 100,
+    "Spacing": 0,
+    "Angle": 0,
+    "BorderStyle": 1,
+    "Outline": 0,
+    "Shadow": 0,
+    "Alignment": 8,
+    "MarginL": 0,
+    "MarginR": 0,
+    "MarginV": 0,
+    "Encoding": 1,
+}
+
+
+def color(value, default: str = "&H00000000") -> str:
+    """
+    Convert a CSS color ("#RRGGBB", "white", ...) to ASS "&HAABBGGRR".
+    """
+    try:
+        rgb = ImageColor.getrgb(value)
+    except Exception:
+        return default
+    r, g, b = rgb[:3]
+    alpha = 255 - rgb[3] if len(rgb) > 3 else 0
+    return f"&H{alpha:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def timestamp(seconds: float) -> str:
+    centiseconds = max(0, round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def escape_text(text: str) -> str:
+    """
+    Keep text literal: backslashes and braces would start override tags,
+    line breaks become hard breaks.
+    """
+    text = text.replace("\\", "＼").replace("{", "｛").replace("}", "｝")
+    return text.replace("\r\n", "\n").replace("\n", "\\N")
+
+
+def write(
+    ass_file: str,
+    width: int,
+    height: int,
+    style: dict,
+    events: List[Tuple[float, float, str, int, int]],
+):
+    """
+    Write an ASS script with a single style. Each event is (start, end, text,
+    x, y), the text is anchored by its top center at (x, y) in a
+    `width` x `height` frame.
+    """
+    style = {**DEFAULT_STYLE, **style}
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        f"Format: {', '.join(STYLE_FIELDS)}",
+        f"Style: {','.join(str(style[f]) for f in STYLE_FIELDS)}",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for start, end, text, x, y in events:
+        lines.append(
+            f"Dialogue: 0,{timestamp(start)},{timestamp(end)},{style['Name']},,0,0,0,,"
+            f"{{\\an8\\pos({x},{y})}}{escape_text(text)}"
+        )
+    with open(ass_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
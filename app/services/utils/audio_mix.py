@@ -0,0 +1,176 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterator
+
+import numpy as np
+from loguru import logger
+
+from app.services.utils import ffmpeg
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# seconds, the background music fades out at the end of every lap
+BGM_FADE_OUT = 3
+# samples mixed and sent to the encoder at a time
+CHUNK_SAMPLES = SAMPLE_RATE
+
+
+def read(file_path: str, duration: float = None) -> np.ndarray:
+    """
+    Decode an audio file (up to `duration` seconds) to float32 samples of
+    shape (n, CHANNELS).
+    """
+    data = ffmpeg.read_audio(file_path, SAMPLE_RATE, CHANNELS, duration)
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, CHANNELS)
+
+
+# decoded songs kept in memory, the background music of a task is usually
+# picked from a handful of files
+BGM_CACHE_SIZE = 4
+
+_songs = OrderedDict()
+_songs_lock = threading.Lock()
+
+
+def _decode_bgm(bgm_file: str, duration: float):
+    """
+    The first `duration` seconds of a song as int16 samples, and whether
+    that is the whole song. Kept per (song, mtime, size) in memory, a later
+    call needing more of the song decodes it again.
+    """
+    stat = os.stat(bgm_file)
+    key = (os.path.abspath(bgm_file), stat.st_mtime_ns, stat.st_size)
+    n = round(duration * SAMPLE_RATE)
+    with _songs_lock:
+        entry = _songs.get(key)
+        if entry is not None:
+            _songs.move_to_end(key)
+    if entry is not None and (entry[1] or len(entry[0]) >= n):
+        return entry
+
+    samples = read(bgm_file, duration)
+    pcm = np.round(np.clip(samples, -1, 1) * 32767).astype(np.int16)
+    entry = (pcm, len(pcm) < n)
+    with _songs_lock:
+        _songs[key] = entry
+        _songs.move_to_end(key)
+        while len(_songs) > BGM_CACHE_SIZE:
+            _songs.popitem(last=False)
+    return entry
+
+
+def bgm_loop(
+    bgm_file: str, duration: float, volume: float, chunk_samples: int = CHUNK_SAMPLES
+) -> Iterator[np.ndarray]:
+    """
+    The background music scaled by `volume`, faded out at its end and looped
+    to `duration` seconds, as float32 chunks of `chunk_samples` samples.
+    Songs are usually longer than the video, only the part that is heard is
+    decoded (right away, so errors are raised here), and kept in memory for
+    the next tasks.
+    """
+    n = round(duration * SAMPLE_RATE)
+    fade_n = round(BGM_FADE_OUT * SAMPLE_RATE)
+    pcm, _ = _decode_bgm(bgm_file, duration + BGM_FADE_OUT)
+    # the song outlasts the video, the fade out is never heard
+    looped = len(pcm) < n + fade_n
+    return _loop_chunks(pcm, n, volume, fade_n if looped else 0, chunk_samples)
+
+
+def _loop_chunks(
+    pcm: np.ndarray, n: int, volume: float, fade_n: int, chunk_samples: int
+) -> Iterator[np.ndarray]:
+    lap = len(pcm)
+    if not lap:
+        return
+    scale = np.float32(volume / 32767)
+    fade_n = min(fade_n, lap)
+    fade = np.linspace(1, 0, fade_n, dtype=np.float32)[:, np.newaxis]
+    fade_start = lap - fade_n
+    for start in range(0, n, chunk_samples):
+        chunk = np.empty((min(chunk_samples, n - start), CHANNELS), dtype=np.float32)
+        filled = 0
+        while filled < len(chunk):
+            offset = (start + filled) % lap
+            end = min(lap, offset + len(chunk) - filled)
+            part = chunk[filled : filled + end - offset]
+            np.multiply(pcm[offset:end], scale, out=part)
+            if fade_n and end > fade_start:
+                begin = max(offset, fade_start)
+                part[begin - offset :] *= fade[begin - fade_start : end - fade_start]
+            filled += end - offset
+        yield chunk
+
+
+def mix(
+    output_file: str,
+    audio_file: str,
+    duration: float,
+    voice_volume: float = 1.0,
+    bgm_file: str = "",
+    bgm_volume: float = 0.2,
+) -> bool:
+    """
+    Mix the narration with the looped background music into one AAC file of
+    `duration` seconds, so the video encode only has to mux the result. The
+    narration is decoded, mixed with NumPy and piped to the encoder a chunk
+    at a time, memory use does not grow with the duration.
+    """
+    n = round(duration * SAMPLE_RATE)
+    bgm = None
+    if bgm_file:
+        try:
+            bgm = bgm_loop(bgm_file, duration, bgm_volume)
+        except Exception as e:
+            logger.error(f"failed to add bgm: {str(e)}")
+
+    def chunks():
+        frame_size = CHANNELS * 4
+        voice = ffmpeg.read_audio_chunks(
+            audio_file, SAMPLE_RATE, CHANNELS, CHUNK_SAMPLES * frame_size, duration
+        )
+        for start in range(0, n, CHUNK_SAMPLES):
+            chunk = np.zeros((min(CHUNK_SAMPLES, n - start), CHANNELS), np.float32)
+            data = next(voice, b"")
+            samples = np.frombuffer(
+                data[: len(data) - len(data) % frame_size], np.float32
+            )
+            samples = samples.reshape(-1, CHANNELS)[: len(chunk)]
+            np.multiply(samples, np.float32(voice_volume), out=chunk[: len(samples)])
+            if bgm is not None:
+                chunk += next(bgm)
+            np.clip(chunk, -1, 1, out=chunk)
+            yield chunk.tobytes()
+        # the rest is at most a rounding error, raises if decoding failed
+        for _ in voice:
+            pass
+
+    temp_file = ffmpeg.temp_path(output_file)
+    try:
+        ok = ffmpeg.run(
+            [
+                "-f",
+                "f32le",
+                "-ar",
+                str(SAMPLE_RATE),
+                "-ac",
+                str(CHANNELS),
+                "-i",
+                "-",
+                "-c:a",
+                "aac",
+                temp_file,
+            ],
+            input=chunks(),
+        )
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    if not ok:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return False
+    os.replace(temp_file, output_file)
+    return True
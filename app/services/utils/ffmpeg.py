@@ -0,0 +1,348 @@
+import os
+import re
+import subprocess
+import threading
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Union
+
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+from moviepy.tools import cross_platform_popen_params
+from moviepy.video.io.ffmpeg_reader import FFmpegInfosParser
+
+
+def run(args: List[str], input: Union[bytes, Iterable[bytes]] = None) -> bool:
+    """
+    Run ffmpeg with the given arguments (without the binary itself), `input`
+    is written to its stdin, either at once or chunk by chunk as an iterable
+    is consumed. Returns True on success, logs stderr and returns False
+    otherwise. Errors raised by the iterable are passed on.
+    """
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y", *args]
+    popen_params = cross_platform_popen_params(
+        {
+            "stdout": subprocess.DEVNULL,
+            "stderr": subprocess.PIPE,
+            "stdin": subprocess.DEVNULL if input is None else subprocess.PIPE,
+        }
+    )
+    try:
+        proc = subprocess.Popen(cmd, **popen_params)
+    except Exception as e:
+        logger.error(f"failed to run ffmpeg: {str(e)}")
+        return False
+
+    if input is not None and not isinstance(input, bytes):
+        try:
+            for chunk in input:
+                proc.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg has exited, its stderr tells why
+            pass
+        except BaseException:
+            proc.kill()
+            proc.communicate()
+            raise
+        input = None
+    try:
+        _, stderr = proc.communicate(input)
+    except Exception as e:
+        proc.kill()
+        proc.communicate()
+        logger.error(f"failed to run ffmpeg: {str(e)}")
+        return False
+
+    if proc.returncode != 0:
+        error = stderr.decode("utf-8", errors="ignore").strip()
+        logger.error(f"ffmpeg exited with code {proc.returncode}: {error}")
+        return False
+    return True
+
+
+def _communicate(cmd: List[str]):
+    popen_params = cross_platform_popen_params(
+        {
+            "stdout": subprocess.PIPE,
+            "stderr": subprocess.PIPE,
+            "stdin": subprocess.DEVNULL,
+        }
+    )
+    proc = subprocess.Popen(cmd, **popen_params)
+    stdout, stderr = proc.communicate()
+    return (
+        proc.returncode,
+        stdout.decode("utf-8", errors="ignore"),
+        stderr.decode("utf-8", errors="ignore"),
+    )
+
+
+@lru_cache(maxsize=None)
+def has_filter(name: str) -> bool:
+    """
+    Whether the ffmpeg build has the filter `name` (e.g. "subtitles", which
+    needs libass).
+    """
+    try:
+        _, output, _ = _communicate([FFMPEG_BINARY, "-hide_banner", "-filters"])
+    except Exception as e:
+        logger.error(f"failed to list ffmpeg filters: {str(e)}")
+        return False
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1] == name:
+            return True
+    return False
+
+
+def escape_filter_value(value: str) -> str:
+    """
+    Escape a filter option value (e.g. a file path) for use in a -vf
+    filtergraph: once for the option parser, once for the graph parser.
+    """
+    value = value.replace("\\", "/")
+    for c in "\\':":
+        value = value.replace(c, "\\" + c)
+    for c in "\\'[],;":
+        value = value.replace(c, "\\" + c)
+    return value
+
+
+def probe(file_path: str) -> dict:
+    """
+    Read duration, fps, size and codec of the first video stream (or the
+    duration of an audio file) from the container header, like ffprobe.
+    Nothing is decoded. Raises IOError if ffmpeg cannot parse the file.
+    """
+    _, _, infos = _communicate([FFMPEG_BINARY, "-hide_banner", "-i", file_path])
+    try:
+        parsed = FFmpegInfosParser(infos, file_path).parse()
+    except Exception as e:
+        raise IOError(f"failed to parse media file: {file_path}") from e
+
+    codec = ""
+    match = re.search(r"Stream #\d+:\d+.*?: Video: (\w+)", infos)
+    if match:
+        codec = match.group(1)
+    width, height = parsed.get("video_size") or (0, 0)
+    return {
+        "duration": parsed.get("video_duration") or parsed.get("duration") or 0,
+        "fps": parsed.get("video_fps") or 0,
+        "width": width,
+        "height": height,
+        "codec": codec,
+        "video_found": parsed.get("video_found", False),
+        "audio_found": parsed.get("audio_found", False),
+    }
+
+
+def _audio_decoder(
+    file_path: str, sample_rate: int, channels: int, duration: float = None
+) -> subprocess.Popen:
+    cmd = [
+        FFMPEG_BINARY,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        file_path,
+        "-vn",
+        "-f",
+        "f32le",
+        "-acodec",
+        "pcm_f32le",
+        "-ac",
+        str(channels),
+        "-ar",
+        str(sample_rate),
+        *(["-t", f"{duration:.6f}"] if duration else []),
+        "-",
+    ]
+    popen_params = cross_platform_popen_params(
+        {
+            "stdout": subprocess.PIPE,
+            "stderr": subprocess.PIPE,
+            "stdin": subprocess.DEVNULL,
+        }
+    )
+    return subprocess.Popen(cmd, **popen_params)
+
+
+def read_audio(
+    file_path: str, sample_rate: int, channels: int, duration: float = None
+) -> bytes:
+    """
+    Decode the first audio stream of a file (up to `duration` seconds) to
+    interleaved float32 PCM at `sample_rate` with `channels` channels.
+    Raises IOError on failure.
+    """
+    proc = _audio_decoder(file_path, sample_rate, channels, duration)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        error = stderr.decode("utf-8", errors="ignore").strip()
+        raise IOError(f"failed to decode audio: {file_path} => {error}")
+    return stdout
+
+
+def read_audio_chunks(
+    file_path: str,
+    sample_rate: int,
+    channels: int,
+    chunk_size: int,
+    duration: float = None,
+) -> Iterator[bytes]:
+    """
+    Like read_audio, but yields the PCM in chunks of `chunk_size` bytes (the
+    last one may be shorter) while ffmpeg decodes. Raises IOError once the
+    output is exhausted if decoding failed.
+    """
+    proc = _audio_decoder(file_path, sample_rate, channels, duration)
+    try:
+        while True:
+            data = proc.stdout.read(chunk_size)
+            if not data:
+                break
+            yield data
+        stderr = proc.stderr.read()
+        proc.wait()
+        if proc.returncode != 0:
+            error = stderr.decode("utf-8", errors="ignore").strip()
+            raise IOError(f"failed to decode audio: {file_path} => {error}")
+    finally:
+        # also when the caller stops early
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def keyframes(file_path: str) -> List[float]:
+    """
+    Timestamps (seconds) of the keyframes of the first video stream. Packets
+    are listed by stream copy into the framecrc muxer, which flags every
+    non-key packet, so the file is read but not decoded.
+    """
+    returncode, output, error = _communicate(
+        [
+            FFMPEG_BINARY,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            file_path,
+            "-map",
+            "0:v:0",
+            "-c",
+            "copy",
+            "-f",
+            "framecrc",
+            "-",
+        ]
+    )
+    if returncode != 0:
+        raise IOError(f"failed to list keyframes: {file_path} => {error.strip()}")
+
+    time_base = 1.0
+    result = []
+    for line in output.splitlines():
+        if line.startswith("#tb 0:"):
+            num, den = line.split(":", 1)[1].strip().split("/")
+            time_base = int(num) / int(den)
+            continue
+        if line.startswith("#") or "F=" in line:
+            continue
+        # stream, dts, pts, duration, size, crc
+        fields = [f.strip() for f in line.split(",")]
+        if len(fields) >= 3:
+            result.append(round(max(int(fields[2]), 0) * time_base, 6))
+    return sorted(result)
+
+
+def temp_path(output_file: str, tag: str = "", ext: str = "") -> str:
+    """
+    Path of a sibling temp file, used to write outputs that are then moved
+    into place with os.replace so readers never see a partial file. `tag`
+    tells apart several temp files of the same output.
+    """
+    directory, filename = os.path.split(output_file)
+    suffix = f"{os.getpid()}-{threading.get_ident()}"
+    if tag:
+        suffix = f"{suffix}-{tag}"
+    if not ext:
+        _, ext = os.path.splitext(filename)
+    return os.path.join(directory, f".{filename}.{suffix}.tmp{ext}")
+
+
+def concat(entries: List[dict], output_file: str) -> bool:
+    """
+    Join files with the concat demuxer by stream copy, all inputs must share
+    codec parameters. Each entry has a `file` and optionally an `inpoint` and
+    `outpoint`, which should fall on keyframes.
+    """
+
+    def quote(file):
+        return "'" + file.replace("\\", "/").replace("'", "'\\''") + "'"
+
+    lines = []
+    for entry in entries:
+        lines.append(f"file {quote(os.path.abspath(entry['file']))}")
+        if entry.get("inpoint"):
+            lines.append(f"inpoint {entry['inpoint']:.6f}")
+        if entry.get("outpoint"):
+            lines.append(f"outpoint {entry['outpoint']:.6f}")
+
+    list_file = temp_path(output_file, tag="concat", ext=".txt")
+    try:
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return run(
+            [
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_file,
+                "-c",
+                "copy",
+                "-an",
+                "-movflags",
+                "+faststart",
+                output_file,
+            ]
+        )
+    finally:
+        if os.path.exists(list_file):
+            os.remove(list_file)
+
+
+def mux(video_file: str, audio_file: str, output_file: str) -> bool:
+    """
+    Put the video stream of `video_file` and the audio stream of `audio_file`
+    into `output_file` without re-encoding either.
+    """
+    temp_file = temp_path(output_file)
+    ok = run(
+        [
+            "-i",
+            video_file,
+            "-i",
+            audio_file,
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0",
+            "-c",
+            "copy",
+            "-shortest",
+            "-movflags",
+            "+faststart",
+            temp_file,
+        ]
+    )
+    if not ok:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return False
+    os.replace(temp_file, output_file)
+    return True
@@ -0,0 +1,286 @@
+import glob
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, List
+
+from loguru import logger
+
+
+class FileCache:
+    """
+    Keeps the files of `directory` matching any of `patterns` (relative to
+    it) under `max_bytes` by deleting the least recently used ones.
+
+    Last use is recorded in the access time of each file (set explicitly,
+    the modification time is left alone as metadata sidecars depend on it),
+    so the index survives restarts and is shared with other processes: the
+    directory is scanned again before every eviction run. Eviction runs in a
+    background thread once an added file takes the cache over budget, and
+    frees space down to `low_watermark` of the budget. Pinned files are
+    never evicted, pins only cover this process.
+
+    Files named after an entry plus one of the `sidecars` suffixes (e.g.
+    metadata) count towards its size and are deleted with it. Files matching
+    `temp_patterns` (e.g. partial downloads) count towards the budget but are
+    in use while they are written to, they are only deleted once they have
+    not been modified for `temp_max_age` seconds.
+
+    `on_evict(path)` is called after a file is deleted, to remove files
+    derived from it.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        patterns: List[str] = ("*",),
+        low_watermark: float = 0.9,
+        on_evict: Callable[[str], None] = None,
+        sidecars: List[str] = (),
+        temp_patterns: List[str] = (),
+        temp_max_age: float = 86400,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.patterns = list(patterns)
+        self.sidecars = list(sidecars)
+        self.temp_patterns = list(temp_patterns)
+        self.temp_max_age = temp_max_age
+        self.low_watermark = low_watermark
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._index = None
+        self._pins = Counter()
+        self._evicting = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def _scan(self) -> dict:
+        # path -> [size with sidecars, last use, whether it is a temp file]
+        index = {}
+        for patterns, temp in ((self.patterns, False), (self.temp_patterns, True)):
+            for pattern in patterns:
+                for path in glob.glob(os.path.join(self.directory, pattern)):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    last_used = stat.st_mtime if temp else stat.st_atime
+                    size = stat.st_size + self._sidecars_size(path)
+                    index[os.path.abspath(path)] = [size, last_used, temp]
+        return index
+
+    def _sidecars_size(self, file_path: str) -> int:
+        size = 0
+        for suffix in self.sidecars:
+            try:
+                size += os.path.getsize(file_path + suffix)
+            except OSError:
+                pass
+        return size
+
+    def _ensure_index(self):
+        if self._index is None:
+            self._index = self._scan()
+
+    def _record(self, file_path: str) -> bool:
+        now = time.time()
+        try:
+            stat = os.stat(file_path)
+            os.utime(file_path, (now, stat.st_mtime))
+        except OSError as e:
+            logger.warning(f"failed to record cache access: {file_path} => {str(e)}")
+            return False
+        with self._lock:
+            self._ensure_index()
+            size = stat.st_size + self._sidecars_size(file_path)
+            self._index[os.path.abspath(file_path)] = [size, now, False]
+        return True
+
+    def hit(self, file_path: str) -> bool:
+        """
+        A cached file is used again. False if it is gone (e.g. just evicted).
+        """
+        with self._lock:
+            self.hits += 1
+        return self._record(file_path)
+
+    def add(self, file_path: str):
+        """
+        A file was missing and has been added, evicts in the background when
+        the cache is over budget.
+        """
+        with self._lock:
+            self.misses += 1
+        if self._record(file_path):
+            self._maybe_evict()
+
+    @contextmanager
+    def pin(self, file_paths: List[str] = ()):
+        """
+        Keep `file_paths` from being evicted inside the with block. Yields
+        the Pins, more files can be added to them while the block runs.
+        """
+        pins = Pins(self)
+        for file_path in file_paths:
+            pins.add(file_path)
+        try:
+            yield pins
+        finally:
+            pins.release()
+
+    def size(self) -> int:
+        with self._lock:
+            self._ensure_index()
+            return sum(entry[0] for entry in self._index.values())
+
+    def _maybe_evict(self):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if self._evicting:
+                return
+            self._ensure_index()
+            total = sum(entry[0] for entry in self._index.values())
+            if total <= self.max_bytes:
+                return
+            self._evicting = True
+        threading.Thread(target=self._evict, name="cache-eviction", daemon=True).start()
+
+    def _evict(self):
+        try:
+            self.evict()
+        except Exception as e:
+            logger.error(f"failed to evict cached files: {str(e)}")
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def evict(self) -> int:
+        """
+        Delete stale temp files, then least recently used, unpinned files
+        until the cache is under the low watermark. Returns the number of
+        bytes freed.
+        """
+        index = self._scan()
+        with self._lock:
+            self._index = index
+            total = sum(entry[0] for entry in index.values())
+            target = self.max_bytes * self.low_watermark
+            candidates = sorted(
+                (last_used, path)
+                for path, (_, last_used, temp) in index.items()
+                if not temp and not self._pins.get(path)
+            )
+
+        freed = self._remove_stale()
+        for _, path in candidates:
+            if total - freed <= target:
+                break
+            freed += self._remove(path)
+
+        if freed:
+            logger.info(
+                f"evicted {freed / 1024 / 1024:.1f} MB from {self.directory}, "
+                f"stats: {self.stats()}"
+            )
+        return freed
+
+    def remove_stale(self) -> int:
+        """
+        Delete the temp files not modified for `temp_max_age` seconds, e.g.
+        parts of abandoned downloads, whatever the budget. Returns the number
+        of bytes freed.
+        """
+        index = self._scan()
+        with self._lock:
+            self._index = index
+        freed = self._remove_stale()
+        if freed:
+            logger.info(
+                f"removed {freed / 1024 / 1024:.1f} MB of stale files from "
+                f"{self.directory}"
+            )
+        return freed
+
+    def _remove_stale(self) -> int:
+        now = time.time()
+        with self._lock:
+            stale = [
+                path
+                for path, (_, last_used, temp) in self._index.items()
+                if temp and now - last_used >= self.temp_max_age
+            ]
+        return sum(self._remove(path) for path in stale)
+
+    def _remove(self, path: str) -> int:
+        # under the lock, so a file cannot be pinned while it is deleted
+        with self._lock:
+            if self._pins.get(path):
+                return 0
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"failed to evict cached file: {path} => {str(e)}")
+                return 0
+            size = self._index.pop(path, [0])[0]
+            self.evictions += 1
+            self.evicted_bytes += size
+        for suffix in self.sidecars:
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"failed to evict cached file: {path} => {str(e)}")
+        if self.on_evict:
+            self.on_evict(path)
+        return size
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_index()
+            return {
+                "files": len(self._index),
+                "bytes": sum(entry[0] for entry in self._index.values()),
+                "max_bytes": self.max_bytes,
+                "pinned": len(self._pins),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+class Pins:
+    """
+    Files of a FileCache that must not be evicted until release(), e.g. the
+    materials of a running task. See FileCache.pin.
+    """
+
+    def __init__(self, cache: FileCache):
+        self._cache = cache
+        self._paths = set()
+
+    def add(self, file_path: str):
+        """
+        Pin `file_path`, it does not need to exist yet.
+        """
+        path = os.path.abspath(file_path)
+        with self._cache._lock:
+            if path not in self._paths:
+                self._paths.add(path)
+                self._cache._pins[path] += 1
+
+    def release(self):
+        with self._cache._lock:
+            self._cache._pins.subtract(self._paths)
+            self._cache._pins += Counter()  # drop zero counts
+            self._paths.clear()
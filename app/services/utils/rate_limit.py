@@ -0,0 +1,151 @@
+import threading
+import time
+from typing import List
+
+from loguru import logger
+
+
+class _Bucket:
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # no request before this time, set by 429 responses and exhausted quotas
+        self.blocked_until = 0.0
+        self.failures = 0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        blocked = max(0.0, self.blocked_until - now)
+        missing = max(0.0, 1 - self.tokens) / self.rate
+        return max(blocked, missing)
+
+
+class KeyScheduler:
+    """
+    Spreads requests over several API keys of a provider. Every key has a
+    token bucket of `capacity` requests per `period` seconds, which is kept
+    in line with the rate limit headers of the responses when
+    `headers_match_period` (they count the same window), otherwise they only
+    pause a key until the reset once its quota is used up. acquire() hands
+    out the key with the most budget left. When every key is exhausted or
+    backing off after a 429 it waits for the first one to free up, unless
+    that takes longer than `max_wait` seconds.
+    Thread-safe, one scheduler is shared by all tasks of the process.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        capacity: float,
+        period: float,
+        max_wait: float = 60,
+        headers_match_period: bool = True,
+    ):
+        self.keys = list(keys)
+        self.period = period
+        self.headers_match_period = headers_match_period
+        self.max_wait = max_wait
+        self._buckets = {key: _Bucket(capacity, period) for key in self.keys}
+        self._lock = threading.Lock()
+
+    def acquire(self) -> str:
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for bucket in self._buckets.values():
+                    bucket.refill(now)
+                # a key that is free now (or the soonest), then the most tokens
+                key = min(
+                    self.keys,
+                    key=lambda k: (
+                        self._buckets[k].wait_time(now),
+                        -self._buckets[k].tokens,
+                    ),
+                )
+                bucket = self._buckets[key]
+                wait = bucket.wait_time(now)
+                if wait <= 0 or now + wait > deadline:
+                    if wait > 0:
+                        logger.warning(
+                            f"all api keys are rate limited for {wait:.0f}s, using the best one"
+                        )
+                    bucket.tokens -= 1
+                    return key
+            time.sleep(min(wait, deadline - now, 5))
+
+    def update(self, key: str, headers, status_code: int = 200):
+        """
+        Sync the bucket of `key` with the X-RateLimit-* headers of a
+        response, or only block it until the reset when the headers count
+        another window and nothing is left. The reset header is either
+        seconds to wait or a unix time.
+        Any response but a 429 ends the exponential backoff of the key.
+        """
+        limit = _header_number(headers, "X-RateLimit-Limit")
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        reset = _header_number(headers, "X-RateLimit-Reset")
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            now = time.monotonic()
+            bucket.refill(now)
+            if status_code != 429:
+                bucket.failures = 0
+            if self.headers_match_period:
+                if limit:
+                    bucket.capacity = limit
+                    bucket.rate = limit / self.period
+                if remaining is not None:
+                    bucket.tokens = min(bucket.tokens, remaining)
+            if remaining is not None and remaining <= 0 and reset:
+                bucket.blocked_until = now + _reset_seconds(reset)
+
+    def backoff(self, key: str, retry_after: float = None) -> float:
+        """
+        Take `key` out of rotation after a 429, for `retry_after` seconds or
+        an exponential backoff when the server does not say. Returns the delay.
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0
+            bucket.failures += 1
+            delay = retry_after or min(2**bucket.failures, self.period)
+            bucket.tokens = 0
+            bucket.updated = time.monotonic()
+            bucket.blocked_until = bucket.updated + delay
+            return delay
+
+
+def _header_number(headers, name: str):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def _reset_seconds(reset: float) -> float:
+    # Pexels sends a unix timestamp, Pixabay the seconds left
+    if reset > 1e9:
+        return max(0.0, reset - time.time())
+    return reset
+
+
+def retry_after(headers) -> float:
+    """
+    Seconds from a Retry-After header (or the rate limit reset), None if
+    the response does not say.
+    """
+    seconds = _header_number(headers, "Retry-After")
+    if seconds is None:
+        reset = _header_number(headers, "X-RateLimit-Reset")
+        if reset:
+            seconds = _reset_seconds(reset)
+    return seconds
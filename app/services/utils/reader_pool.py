@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+from moviepy import VideoFileClip
+
+
+class ReaderPool:
+    """
+    Shares one VideoFileClip per source file between all subclips of a render
+    and bounds the number of ffmpeg reader processes that are open at once.
+
+    When more than `max_readers` readers are open, the least recently used one
+    is closed. Its clip stays valid: the reader is re-opened at the requested
+    time the next time a frame is read from it. close() releases every reader,
+    use the pool as a context manager around building and writing the clip.
+
+    `slot` opens another reader of the same file, for parts of a render that
+    read it at a different time in parallel (e.g. both sides of a crossfade).
+    """
+
+    def __init__(self, max_readers: int = 8):
+        self.max_readers = max(1, max_readers)
+        self._clips = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reopened = 0
+        self.evicted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, video_path: str, slot: int = 0) -> VideoFileClip:
+        key = (video_path, slot)
+        with self._lock:
+            clip = self._clips.get(key)
+            if clip is not None:
+                self._clips.move_to_end(key)
+                return clip
+
+        # audio=False, materials are always rendered without their own sound
+        clip = VideoFileClip(video_path, audio=False)
+        frame_function = clip.frame_function
+
+        def get_frame(t):
+            self._touch(key, t)
+            return frame_function(t)
+
+        clip.frame_function = get_frame
+        with self._lock:
+            self._clips[key] = clip
+            self.opened += 1
+        self._evict(keep=key)
+        return clip
+
+    def _touch(self, key: tuple, t: float):
+        with self._lock:
+            clip = self._clips.get(key)
+            if clip is None or clip.reader is None:
+                return
+            self._clips.move_to_end(key)
+            reopen = clip.reader.proc is None
+            if reopen:
+                # initialize here, moviepy would print "Proc not detected"
+                clip.reader.initialize(t)
+                self.reopened += 1
+        if reopen:
+            self._evict(keep=key)
+
+    def _evict(self, keep: tuple):
+        with self._lock:
+            open_keys = [k for k, c in self._clips.items() if _is_open(c)]
+            for key in open_keys[: max(0, len(open_keys) - self.max_readers)]:
+                if key == keep:
+                    continue
+                self._clips[key].reader.close(delete_lastread=False)
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            readers = [c.reader for c in self._clips.values() if _is_open(c)]
+            bytes_buffered = 0
+            for reader in readers:
+                bytes_buffered += reader.bufsize
+                last_read = getattr(reader, "last_read", None)
+                if last_read is not None:
+                    bytes_buffered += last_read.nbytes
+            return {
+                "open_readers": len(readers),
+                "max_readers": self.max_readers,
+                "sources": len({path for path, _ in self._clips}),
+                "opened": self.opened,
+                "reopened": self.reopened,
+                "evicted": self.evicted,
+                "bytes_buffered": bytes_buffered,
+            }
+
+    def close(self):
+        with self._lock:
+            clips = list(self._clips.values())
+            self._clips.clear()
+        for clip in clips:
+            try:
+                clip.close()
+            except Exception as e:
+                logger.warning(f"failed to close video reader: {str(e)}")
+
+
+def _is_open(clip: VideoFileClip) -> bool:
+    return clip.reader is not None and clip.reader.proc is not None
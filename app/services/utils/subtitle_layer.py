@@ -0,0 +1,119 @@
+from bisect import bisect_right
+from typing import List, NamedTuple
+
+import numpy as np
+from moviepy import VideoClip
+
+
+class Bitmap(NamedTuple):
+    """
+    A rasterized cue: color premultiplied by alpha and the inverse alpha
+    (255 - alpha), both uint8 and read-only so they can be shared by caches.
+    """
+
+    premultiplied: np.ndarray
+    transparency: np.ndarray
+
+    @property
+    def size(self):
+        h, w = self.transparency.shape[:2]
+        return w, h
+
+
+class Cue(NamedTuple):
+    start: float
+    end: float
+    x: int
+    y: int
+    bitmap: Bitmap
+
+
+def rasterize(clip: VideoClip) -> Bitmap:
+    """
+    Render the first frame of a (text) clip and its mask into a Bitmap.
+    """
+    rgb = clip.get_frame(0).astype(np.uint16)
+    if clip.mask is not None:
+        alpha = np.round(clip.mask.get_frame(0) * 255).astype(np.uint16)
+    else:
+        alpha = np.full(rgb.shape[:2], 255, dtype=np.uint16)
+    alpha = alpha[:, :, np.newaxis]
+    premultiplied = ((rgb * alpha + 127) // 255).astype(np.uint8)
+    transparency = (255 - alpha).astype(np.uint8)
+    premultiplied.flags.writeable = False
+    transparency.flags.writeable = False
+    return Bitmap(premultiplied, transparency)
+
+
+def blit(frame: np.ndarray, bitmap: Bitmap, x: int, y: int):
+    """
+    Alpha-blend `bitmap` onto `frame` in place at (x, y), only the part of
+    the bounding box that lies inside the frame is touched.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    w, h = bitmap.size
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, frame_w), min(y + h, frame_h)
+    if x1 <= x0 or y1 <= y0:
+        return
+
+    box = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    region = frame[y0:y1, x0:x1]
+    blended = region.astype(np.uint16) * bitmap.transparency[box]
+    blended = (blended + 127) // 255 + bitmap.premultiplied[box]
+    region[...] = np.minimum(blended, 255)
+
+
+class SubtitleIndex:
+    """
+    Cues sorted by start time. active(t) finds the cues shown at `t` with a
+    binary search, walking back only while an earlier cue can still be on
+    screen, so the cost does not grow with the number of cues.
+    """
+
+    def __init__(self, cues: List[Cue]):
+        self.cues = sorted(cues, key=lambda c: (c.start, c.end))
+        self.starts = [c.start for c in self.cues]
+        # max_ends[i] is the latest end among cues[0..i]
+        self.max_ends = []
+        latest = float("-inf")
+        for cue in self.cues:
+            latest = max(latest, cue.end)
+            self.max_ends.append(latest)
+
+    def __len__(self):
+        return len(self.cues)
+
+    def active(self, t: float) -> List[Cue]:
+        result = []
+        i = bisect_right(self.starts, t) - 1
+        while i >= 0 and self.max_ends[i] > t:
+            cue = self.cues[i]
+            if cue.end > t:
+                result.append(cue)
+            i -= 1
+        result.reverse()
+        return result
+
+
+def overlay(video_clip: VideoClip, cues: List[Cue]) -> VideoClip:
+    """
+    Blit the cues over `video_clip`. Each frame only looks at the cues that
+    are active at its time, frames without a cue are passed through.
+    """
+    index = SubtitleIndex(cues)
+    if not index:
+        return video_clip
+
+    def draw(get_frame, t):
+        frame = get_frame(t)
+        active = index.active(t)
+        if not active:
+            return frame
+        # copy, the source may reuse its frame buffer
+        frame = np.array(frame, dtype=np.uint8)
+        for cue in active:
+            blit(frame, cue.bitmap, cue.x, cue.y)
+        return frame
+
+    return video_clip.transform(draw)
@@ -1,21 +1,264 @@
-from moviepy import Clip, vfx
+import math
+import os
+from bisect import bisect_right
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from moviepy import Clip, VideoClip
+from PIL import Image
+
+from app.models import const
+
+TRANSITION_FPS = 30
+
+
+@lru_cache(maxsize=16)
+def _fade_weights(t: float, fps: int) -> np.ndarray:
+    """
+    Brightness of a fade from black in 1/256 steps, for the n + 1 frame steps
+    of a `t` second fade: from 0 up to 256.
+    """
+    n = max(1, round(t * fps))
+    weights = np.round(256 * np.arange(n + 1) / n).astype(np.uint16)
+    weights.flags.writeable = False
+    return weights
+
+
+@lru_cache(maxsize=64)
+def _slide_offsets(t: float, fps: int, length: int) -> np.ndarray:
+    """
+    Offsets in pixels of a slide over `length` pixels, for the n + 1 frame
+    steps of a `t` second slide: from `length` (out of view) down to 0.
+    """
+    n = max(1, round(t * fps))
+    offsets = (length * (n - np.arange(n + 1))) // n
+    offsets = offsets.astype(np.int32)
+    offsets.flags.writeable = False
+    return offsets
+
+
+def _step(t: float, fps: int, n: int) -> int:
+    return min(max(int(round(t * fps)), 0), n)
+
+
+def _fade(clip: Clip, t: float, fade_in: bool, fps: int) -> Clip:
+    weights = _fade_weights(t, fps)
+    n = len(weights) - 1
+    w, h = clip.size
+    weighted = np.empty((h, w, 3), dtype=np.uint16)
+    frame_buffer = np.empty((h, w, 3), dtype=np.uint8)
+
+    def filter(get_frame, ct):
+        # frame steps since the start (fade in) or until the end (fade out)
+        k = _step(ct if fade_in else clip.duration - ct, fps, n)
+        frame = get_frame(ct)
+        if k >= n:
+            return frame
+        np.multiply(frame[:, :, :3], weights[k], out=weighted, dtype=np.uint16)
+        np.add(weighted, 128, out=weighted)
+        np.right_shift(weighted, 8, out=weighted)
+        frame_buffer[...] = weighted
+        return frame_buffer
+
+    return clip.transform(filter)
+
+
+def _slide(clip: Clip, t: float, side: str, slide_in: bool, fps: int) -> Clip:
+    w, h = clip.size
+    offsets = _slide_offsets(t, fps, w if side in ("left", "right") else h)
+    n = len(offsets) - 1
+    # direction the content is moved to while it is out of view
+    dx, dy = {"left": (-1, 0), "right": (1, 0), "top": (0, -1), "bottom": (0, 1)}[side]
+    frame_buffer = np.zeros((h, w, 3), dtype=np.uint8)
+
+    def filter(get_frame, ct):
+        k = _step(ct if slide_in else clip.duration - ct, fps, n)
+        frame = get_frame(ct)
+        if k >= n:
+            return frame
+        x, y = dx * int(offsets[k]), dy * int(offsets[k])
+        frame_buffer[...] = 0
+        if abs(x) < w and abs(y) < h:
+            frame_buffer[max(y, 0) : h + min(y, 0), max(x, 0) : w + min(x, 0)] = frame[
+                max(-y, 0) : h - max(y, 0), max(-x, 0) : w - max(x, 0), :3
+            ]
+        return frame_buffer
+
+    return clip.transform(filter)
+
+
+# The transitions below precompute their per-frame factors and offsets and
+# write each frame into a buffer reused by the clip, consumers must not keep
+# a frame after asking for the next one.
 
 
 # FadeIn
-def fadein_transition(clip: Clip, t: float) -> Clip:
-    return clip.with_effects([vfx.FadeIn(t)])
+def fadein_transition(clip: Clip, t: float, fps: int = TRANSITION_FPS) -> Clip:
+    return _fade(clip, t, fade_in=True, fps=fps)
 
 
 # FadeOut
-def fadeout_transition(clip: Clip, t: float) -> Clip:
-    return clip.with_effects([vfx.FadeOut(t)])
+def fadeout_transition(clip: Clip, t: float, fps: int = TRANSITION_FPS) -> Clip:
+    return _fade(clip, t, fade_in=False, fps=fps)
 
 
 # SlideIn
-def slidein_transition(clip: Clip, t: float, side: str) -> Clip:
-    return clip.with_effects([vfx.SlideIn(t, side)])
+def slidein_transition(
+    clip: Clip, t: float, side: str, fps: int = TRANSITION_FPS
+) -> Clip:
+    return _slide(clip, t, side, slide_in=True, fps=fps)
 
 
 # SlideOut
-def slideout_transition(clip: Clip, t: float, side: str) -> Clip:
-    return clip.with_effects([vfx.SlideOut(t, side)])
+def slideout_transition(
+    clip: Clip, t: float, side: str, fps: int = TRANSITION_FPS
+) -> Clip:
+    return _slide(clip, t, side, slide_in=False, fps=fps)
+
+
+# Crossfade
+def crossfade_concatenate(
+    clips: List[Clip],
+    overlaps: List[float],
+    fps: int = TRANSITION_FPS,
+    tails: List[Clip] = None,
+) -> Clip:
+    """
+    Play `clips` one after another, clip i starting `overlaps[i]` seconds
+    before clip i - 1 ends. Over an overlap the two frames are blended with
+    a weight that ramps linearly, one blend per overlapping frame. The
+    outgoing frames of an overlap are read from `tails[i - 1]` when given, a
+    copy of clip i - 1 with its own reader.
+    """
+    tails = tails or clips
+    starts = []
+    end = 0
+    for clip, overlap in zip(clips, overlaps):
+        start = max(end - (overlap if starts else 0), 0)
+        starts.append(start)
+        end = start + clip.duration
+    w, h = clips[0].size
+    incoming = np.empty((h, w, 3), dtype=np.uint16)
+    outgoing = np.empty((h, w, 3), dtype=np.uint16)
+    frame_buffer = np.empty((h, w, 3), dtype=np.uint8)
+
+    def frame_function(t):
+        i = max(bisect_right(starts, t) - 1, 0)
+        clip = clips[i]
+        frame = clip.get_frame(min(t - starts[i], clip.duration))
+        overlap = starts[i - 1] + clips[i - 1].duration - t if i > 0 else 0
+        if overlap <= 0:
+            return frame
+        # weight of the incoming clip in 1/256 steps, from 0 at the start of
+        # the overlap to 256 at its end
+        length = starts[i - 1] + clips[i - 1].duration - starts[i]
+        weight = int(round(256 * (1 - overlap / length)))
+        # the incoming frame is weighted before the outgoing one is read, both
+        # may come from the same reused buffer
+        np.multiply(frame[:, :, :3], weight, out=incoming, dtype=np.uint16)
+        previous = tails[i - 1]
+        previous_frame = previous.get_frame(
+            min(t - starts[i - 1], previous.duration - 1 / fps)
+        )
+        np.multiply(
+            previous_frame[:, :, :3], 256 - weight, out=outgoing, dtype=np.uint16
+        )
+        np.add(incoming, outgoing, out=incoming)
+        np.right_shift(incoming, 8, out=incoming)
+        frame_buffer[...] = incoming
+        return frame_buffer
+
+    return VideoClip(frame_function, duration=end)
+
+
+# Letterbox
+def letterbox(clip: Clip, width: int, height: int) -> Clip:
+    """
+    Scale `clip` to fit in `width` x `height` keeping its aspect ratio and
+    center it on black. Each frame is resized straight into a buffer of the
+    target size whose padding is zeroed once, so no canvas is composited.
+    The buffer is reused between frames: consumers must not keep a frame
+    after asking for the next one.
+    """
+    clip_w, clip_h = clip.size
+    scale = min(width / clip_w, height / clip_h)
+    new_width = min(width, round(clip_w * scale))
+    new_height = min(height, round(clip_h * scale))
+    x = (width - new_width) // 2
+    y = (height - new_height) // 2
+    frame_buffer = np.zeros((height, width, 3), dtype=np.uint8)
+    target = frame_buffer[y : y + new_height, x : x + new_width]
+
+    def resize(frame):
+        image = Image.fromarray(frame[:, :, :3])
+        if image.size != (new_width, new_height):
+            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        target[...] = np.asarray(image)
+        return frame_buffer
+
+    return clip.image_transform(resize)
+
+
+@lru_cache(maxsize=16)
+def _image_source(image_path: str, mtime: float, width: int, height: int):
+    """
+    The image in RGB, downscaled to fit in `width` x `height` if larger.
+    `mtime` keeps the cache from serving an image that has changed.
+    """
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+    if image.width > width or image.height > height:
+        image.thumbnail((width, height), Image.Resampling.LANCZOS)
+    return image
+
+
+# Ken Burns
+def zoom_image(
+    image_path: str,
+    start: float,
+    end: float,
+    width: int,
+    height: int,
+    zoom_speed: float = const.IMAGE_ZOOM_SPEED,
+) -> Clip:
+    """
+    Show a still image from `start` to `end` seconds of a slow zoom into its
+    center (1 + zoom_speed * t), letterboxed to `width` x `height`. Each frame
+    is one crop and one resize of the image, which is decoded and downscaled
+    once to the size the strongest zoom needs.
+    """
+    with Image.open(image_path) as image:
+        image_w, image_h = image.size
+    scale = min(width / image_w, height / image_h)
+    new_width = min(width, round(image_w * scale))
+    new_height = min(height, round(image_h * scale))
+    max_zoom = 1 + zoom_speed * end
+    source = _image_source(
+        image_path,
+        os.path.getmtime(image_path),
+        math.ceil(new_width * max_zoom),
+        math.ceil(new_height * max_zoom),
+    )
+    source_w, source_h = source.size
+    x = (width - new_width) // 2
+    y = (height - new_height) // 2
+    frame_buffer = np.zeros((height, width, 3), dtype=np.uint8)
+    target = frame_buffer[y : y + new_height, x : x + new_width]
+
+    def frame_function(t):
+        zoom = 1 + zoom_speed * (start + t)
+        crop_w, crop_h = source_w / zoom, source_h / zoom
+        box = (
+            (source_w - crop_w) / 2,
+            (source_h - crop_h) / 2,
+            (source_w + crop_w) / 2,
+            (source_h + crop_h) / 2,
+        )
+        image = source.resize(
+            (new_width, new_height), Image.Resampling.BICUBIC, box=box
+        )
+        target[...] = np.asarray(image)
+        return frame_buffer
+
+    return VideoClip(frame_function, duration=end - start)
@@ -1,32 +1,39 @@
 import glob
+import math
+import multiprocessing
 import os
 import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from typing import List
 
 from loguru import logger
-from moviepy import (
-    AudioFileClip,
-    ColorClip,
-    CompositeAudioClip,
-    CompositeVideoClip,
-    ImageClip,
-    TextClip,
-    VideoFileClip,
-    afx,
-    concatenate_videoclips,
-)
-from moviepy.video.tools.subtitles import SubtitlesClip
+from moviepy import TextClip, concatenate_videoclips
+from moviepy.video.tools.subtitles import file_to_subtitles
 from PIL import ImageFont
 
+from app.config import config
 from app.models import const
 from app.models.schema import (
     MaterialInfo,
+    RenderProfile,
+    Timeline,
+    TimelineSegment,
     VideoAspect,
     VideoConcatMode,
     VideoParams,
     VideoTransitionMode,
 )
-from app.services.utils import video_effects
+from app.services import material, metadata, timeline
+from app.services.utils import (
+    ass,
+    audio_mix,
+    ffmpeg,
+    subtitle_layer,
+    video_effects,
+)
+from app.services.utils.file_cache import Pins
+from app.services.utils.reader_pool import ReaderPool
 from app.utils import utils
 
 
@@ -56,186 +63,400 @@ def combine_videos(
     max_clip_duration: int = 5,
     threads: int = 2,
     progress_callback=None,
+    video_timeline: Timeline = None,
+    render_profile: RenderProfile = None,
 ) -> str:
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
-    logger.info(f"max duration of audio: {audio_duration} seconds")
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"each clip will be maximum {req_dur} seconds long")
-    output_dir = os.path.dirname(combined_video_path)
-
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
-
-    clips = []
-    video_duration = 0
+    if not video_timeline:
+        audio_duration = timeline.get_duration(audio_file)
+        logger.info(f"max duration of audio: {audio_duration} seconds")
+        video_timeline = timeline.plan(
+            video_paths=video_paths,
+            audio_duration=audio_duration,
+            video_aspect=video_aspect,
+            video_concat_mode=video_concat_mode,
+            video_transition_mode=video_transition_mode,
+            max_clip_duration=max_clip_duration,
+        )
+    video_timeline = _normalize_materials(video_timeline, render_profile)
+    segments = video_timeline.segments
 
-    raw_clips = []
-    for video_path in video_paths:
-        clip = VideoFileClip(video_path).without_audio()
-        clip_duration = clip.duration
-        start_time = 0
-
-        while start_time < clip_duration:
-            end_time = min(start_time + max_clip_duration, clip_duration)
-            split_clip = clip.subclipped(start_time, end_time)
-            raw_clips.append(split_clip)
-            # logger.info(f"splitting from {start_time:.2f} to {end_time:.2f}, clip duration {clip_duration:.2f}, split_clip duration {split_clip.duration:.2f}")
-            start_time = end_time
-            if video_concat_mode.value == VideoConcatMode.sequential.value:
-                break
+    logger.info("writing")
+    if progress_callback:
+        progress_callback(60, "Writing Combined Videos")
+
+    if can_concat_segments(segments, render_profile):
+        if concat_segments(segments, combined_video_path):
+            logger.success("completed")
+            return combined_video_path
+        logger.warning("failed to concat segments, fallback to moviepy")
+
+    with _reader_pool() as reader_pool:
+        video_clip = build_segments_clip(
+            segments, video_timeline.video_aspect, reader_pool, render_profile
+        )
+        # the materials are read without sound and the final video mixes its
+        # own audio, the combined video stays silent
+        video_clip.write_videofile(
+            filename=combined_video_path,
+            threads=threads,
+            logger=None,
+            audio=False,
+            **_encoder_params(render_profile),
+        )
+        video_clip.close()
+        logger.debug(f"video readers: {reader_pool.stats()}")
+    logger.success("completed")
+    return combined_video_path
+
+
+def _normalize_materials(
+    video_timeline: Timeline, render_profile: RenderProfile = None
+) -> Timeline:
+    """
+    Point the segments of `video_timeline` at normalized copies of their
+    materials when the normalized cache is enabled and fits the render profile.
+    """
+    if not uses_normalized_materials(render_profile):
+        return video_timeline
+    return normalize_timelines([video_timeline])[0]
+
+
+def normalize_timelines(
+    video_timelines: List[Timeline], workers: int = 1, pins: Pins = None
+) -> List[Timeline]:
+    """
+    Point the segments of all `video_timelines` at normalized copies of their
+    materials, each source is transcoded once for all of them (by up to
+    `workers` ffmpeg processes at a time). Only done when the normalized
+    cache is enabled, `pins` keeps the copies until the caller is done.
+    """
+    if not config.app.get("normalize_materials", False):
+        return video_timelines
+
+    sources = []
+    for video_timeline in video_timelines:
+        for segment in video_timeline.segments:
+            source = (segment.path, VideoAspect(video_timeline.video_aspect))
+            if source not in sources:
+                sources.append(source)
+
+    def normalize(source):
+        video_path, aspect = source
+        # images are zoomed while rendering, there is nothing to transcode
+        if material.is_normalized_video(video_path) or timeline.is_image(video_path):
+            return video_path
+        return material.normalize_video(video_path, aspect, pins=pins)
+
+    if workers > 1 and len(sources) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            normalized_paths = dict(zip(sources, executor.map(normalize, sources)))
+    else:
+        normalized_paths = {source: normalize(source) for source in sources}
+
+    result = []
+    for video_timeline in video_timelines:
+        aspect = VideoAspect(video_timeline.video_aspect)
+        segments = [
+            segment.model_copy(
+                update={"path": normalized_paths[(segment.path, aspect)]}
+            )
+            for segment in video_timeline.segments
+        ]
+        result.append(video_timeline.model_copy(update={"segments": segments}))
+    return result
+
+
+def _reader_pool() -> ReaderPool:
+    return ReaderPool(max_readers=config.app.get("max_open_readers", 8))
+
+
+def get_render_profile(render_profile: RenderProfile = None) -> dict:
+    """
+    Output settings of `render_profile`, standard when it is not set.
+    """
+    profile = RenderProfile(render_profile or RenderProfile.standard)
+    return const.RENDER_PROFILES[profile.value]
+
+
+def get_resolution(video_aspect: VideoAspect, render_profile: RenderProfile = None):
+    """
+    Output size of `video_aspect` scaled by the render profile, rounded to
+    even numbers as yuv420p requires.
+    """
+    width, height = VideoAspect(video_aspect).to_resolution()
+    scale = get_render_profile(render_profile)["scale"]
+    return round(width * scale / 2) * 2, round(height * scale / 2) * 2
 
-    # random video_paths order
-    if video_concat_mode.value == VideoConcatMode.random.value:
-        random.shuffle(raw_clips)
-
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    while video_duration < audio_duration:
-        for clip in raw_clips:
-            # Check if clip is longer than the remaining audio
-            if (audio_duration - video_duration) < clip.duration:
-                clip = clip.subclipped(0, (audio_duration - video_duration))
-            # Only shorten clips if the calculated clip length (req_dur) is shorter than the actual clip to prevent still image
-            elif req_dur < clip.duration:
-                clip = clip.subclipped(0, req_dur)
-            clip = clip.with_fps(30)
+
+def uses_normalized_materials(render_profile: RenderProfile = None) -> bool:
+    """
+    The normalized cache holds full size videos at NORMALIZED_VIDEO_FPS, other
+    profiles read the original materials.
+    """
+    profile = get_render_profile(render_profile)
+    return profile["scale"] == 1 and profile["fps"] == const.NORMALIZED_VIDEO_FPS
+
+
+def _encoder_params(render_profile: RenderProfile = None, ffmpeg_params=None) -> dict:
+    """
+    write_videofile arguments for the render profile, `ffmpeg_params` are
+    appended to its own.
+    """
+    profile = get_render_profile(render_profile)
+    return {
+        "fps": profile["fps"],
+        "preset": profile["preset"],
+        "ffmpeg_params": ["-crf", str(profile["crf"]), *(ffmpeg_params or [])],
+    }
+
+
+def build_segments_clip(
+    segments: List[TimelineSegment],
+    video_aspect: VideoAspect,
+    reader_pool: ReaderPool,
+    render_profile: RenderProfile = None,
+):
+    """
+    Turn planned segments into one concatenated moviepy clip at the size and
+    frame rate of `render_profile`. Sources are read through `reader_pool`,
+    which must stay open until the clip is written.
+    """
+    video_width, video_height = get_resolution(video_aspect, render_profile)
+    fps = get_render_profile(render_profile)["fps"]
+
+    # Segments repeat when the materials are looped to cover the audio, each
+    # one is built once and the same clip is placed again on later laps
+    base_clips = {}
+    segment_clips = {}
+
+    def build(segment: TimelineSegment, slot: int = 0):
+        source_key = (segment.path, segment.start, segment.end, slot)
+        key = (*source_key, segment.transition, segment.side)
+        if key in segment_clips:
+            return segment_clips[key]
+
+        clip = base_clips.get(source_key)
+        if clip is None and timeline.is_image(segment.path):
+            clip = video_effects.zoom_image(
+                segment.path, segment.start, segment.end, video_width, video_height
+            )
+            clip = clip.with_fps(fps)
+            base_clips[source_key] = clip
+        elif clip is None:
+            clip = reader_pool.get(segment.path, slot).subclipped(
+                segment.start, segment.end
+            )
+            clip = clip.with_fps(fps)
 
             # Not all videos are same size, so we need to resize them
             clip_w, clip_h = clip.size
             if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
-
-                if clip_ratio == video_ratio:
-                    # Resize proportionally
-                    clip = clip.resized((video_width, video_height))
-                else:
-                    # Resize proportionally
-                    if clip_ratio > video_ratio:
-                        # Resize proportionally based on the target width
-                        scale_factor = video_width / clip_w
-                    else:
-                        # Resize proportionally based on the target height
-                        scale_factor = video_height / clip_h
-
-                    new_width = int(clip_w * scale_factor)
-                    new_height = int(clip_h * scale_factor)
-                    clip_resized = clip.resized(new_size=(new_width, new_height))
-
-                    background = ColorClip(
-                        size=(video_width, video_height), color=(0, 0, 0)
-                    )
-                    clip = CompositeVideoClip(
-                        [
-                            background.with_duration(clip.duration),
-                            clip_resized.with_position("center"),
-                        ]
-                    )
-
+                clip = video_effects.letterbox(clip, video_width, video_height)
                 logger.info(
                     f"resizing video to {video_width} x {video_height}, clip size: {clip_w} x {clip_h}"
                 )
+            base_clips[source_key] = clip
 
-            shuffle_side = random.choice(["left", "right", "top", "bottom"])
-            logger.info(f"Using transition mode: {video_transition_mode}")
-            if video_transition_mode.value == VideoTransitionMode.none.value:
-                clip = clip
-            elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                clip = video_effects.fadein_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                clip = video_effects.fadeout_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                transition_funcs = [
-                    lambda c: video_effects.fadein_transition(c, 1),
-                    lambda c: video_effects.fadeout_transition(c, 1),
-                    lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                    lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                ]
-                shuffle_transition = random.choice(transition_funcs)
-                clip = shuffle_transition(clip)
+        transition = segment.transition
+        side = segment.side
+        logger.info(f"Using transition mode: {transition}")
+        if transition == VideoTransitionMode.fade_in.value:
+            clip = video_effects.fadein_transition(clip, 1, fps)
+        elif transition == VideoTransitionMode.fade_out.value:
+            clip = video_effects.fadeout_transition(clip, 1, fps)
+        elif transition == VideoTransitionMode.slide_in.value:
+            clip = video_effects.slidein_transition(clip, 1, side, fps)
+        elif transition == VideoTransitionMode.slide_out.value:
+            clip = video_effects.slideout_transition(clip, 1, side, fps)
+        # crossfades are blended when the clips are joined
 
-            if clip.duration > max_clip_duration:
-                clip = clip.subclipped(0, max_clip_duration)
+        segment_clips[key] = clip
+        return clip
 
-            clips.append(clip)
-            video_duration += clip.duration
-    clips = [CompositeVideoClip([clip]) for clip in clips]
-    video_clip = concatenate_videoclips(clips)
-    video_clip = video_clip.with_fps(30)
-    logger.info("writing")
-    if progress_callback:
-        progress_callback(60, "Writing Combined Videos")
-    # https://github.com/harry0703/MoneyPrinterTurbo/issues/111#issuecomment-2032354030
-    video_clip.write_videofile(
-        filename=combined_video_path,
-        threads=threads,
-        logger=None,
-        temp_audiofile_path=output_dir,
-        audio_codec="aac",
-        fps=30,
+    clips = [build(segment) for segment in segments]
+    overlaps = [segment.overlap for segment in segments]
+
+    if any(overlaps):
+        # the outgoing clip of a crossfade is read while the incoming one
+        # plays: when both come from the same video it gets its own reader,
+        # the shared one would seek back and forth on every blended frame
+        tails = list(clips)
+        for i in range(1, len(segments)):
+            previous = segments[i - 1]
+            if (
+                overlaps[i]
+                and previous.path == segments[i].path
+                and not timeline.is_image(previous.path)
+            ):
+                tails[i - 1] = build(previous, slot=1)
+        video_clip = video_effects.crossfade_concatenate(clips, overlaps, fps, tails)
+    else:
+        video_clip = concatenate_videoclips(clips)
+    logger.debug(
+        f"built {len(segment_clips)} clips for {len(segments)} segments, "
+        f"{len(base_clips)} source ranges"
     )
-    video_clip.close()
-    logger.success("completed")
-    return combined_video_path
+    video_clip = video_clip.with_fps(fps)
+    return video_clip
 
 
-def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
+def can_concat_segments(
+    segments: List[TimelineSegment], render_profile: RenderProfile = None
+) -> bool:
+    """
+    Segments can be joined by stream copy when no effect is applied and every
+    material comes from the normalized cache (same size, fps and codec) that
+    matches the render profile.
+    """
+    if not segments or not uses_normalized_materials(render_profile):
+        return False
+    for segment in segments:
+        if segment.transition or not material.is_normalized_video(segment.path):
+            return False
+    return True
+
+
+def concat_segments(segments: List[TimelineSegment], output_file: str) -> bool:
+    """
+    Join segments with ffmpeg's concat demuxer without re-encoding. Segments
+    starting on a keyframe are referenced in place via inpoint/outpoint, the
+    others are re-encoded on their own first.
+    """
+    temp_file = ffmpeg.temp_path(output_file)
+    segment_files = []
+
+    try:
+        entries = []
+        for index, segment in enumerate(segments):
+            start_time = segment.start
+            end_time = segment.end
+            if metadata.is_keyframe(segment.path, start_time):
+                entries.append(
+                    {
+                        "file": segment.path,
+                        "inpoint": start_time,
+                        "outpoint": end_time,
+                    }
+                )
+                continue
+
+            segment_file = ffmpeg.temp_path(output_file, tag=f"segment-{index}")
+            segment_files.append(segment_file)
+            if not ffmpeg.run(
+                [
+                    "-ss",
+                    f"{start_time:.6f}",
+                    "-i",
+                    segment.path,
+                    "-t",
+                    f"{end_time - start_time:.6f}",
+                    "-an",
+                    *material.normalized_codec_args(),
+                    segment_file,
+                ]
+            ):
+                return False
+            entries.append({"file": segment_file})
+
+        if not ffmpeg.concat(entries, temp_file):
+            return False
+        os.replace(temp_file, output_file)
+        logger.info(f"concatenated {len(segments)} segments without re-encoding")
+        return True
+    finally:
+        for file in [temp_file, *segment_files]:
+            if os.path.exists(file):
+                os.remove(file)
 
-    def get_text_size(inner_text):
-        inner_text = inner_text.strip()
-        left, top, right, bottom = font.getbbox(inner_text)
-        return right - left, bottom - top
 
-    width, height = get_text_size(text)
+@lru_cache(maxsize=32)
+def _load_font(font: str, fontsize: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font, fontsize)
+
+
+@lru_cache(maxsize=32)
+def _glyph_metrics(font: str, fontsize: int) -> dict:
+    # filled lazily by _text_size: char -> (advance, top, bottom)
+    return {}
+
+
+def _text_size(font: str, fontsize: int, text: str):
+    """
+    Size of a line of `text` from the cached metrics of its characters: the
+    sum of their advances and the extent of their ink from top to bottom.
+    """
+    metrics = _glyph_metrics(font, fontsize)
+    width = 0
+    top, bottom = None, None
+    for char in text:
+        metric = metrics.get(char)
+        if metric is None:
+            image_font = _load_font(font, fontsize)
+            _, char_top, _, char_bottom = image_font.getbbox(char)
+            metric = (image_font.getlength(char), char_top, char_bottom)
+            metrics[char] = metric
+        width += metric[0]
+        # blanks have no ink
+        if metric[2] > metric[1]:
+            top = metric[1] if top is None else min(top, metric[1])
+            bottom = metric[2] if bottom is None else max(bottom, metric[2])
+    height = bottom - top if top is not None else 0
+    return width, height
+
+
+def wrap_text(text, max_width, font="Arial", fontsize=60):
+    # Glyph metrics are cached per (font, size) for the process, lines are
+    # measured by adding them up instead of laying out every prefix again
+    def get_text_width(inner_text):
+        return _text_size(font, fontsize, inner_text)[0]
+
+    width, height = _text_size(font, fontsize, text.strip())
     if width <= max_width:
         return text, height
 
     # logger.warning(f"wrapping text, max_width: {max_width}, text_width: {width}, text: {text}")
 
+    # Break between words, keeping a running line width
+    space_width = get_text_width(" ")
     processed = True
-
     _wrapped_lines_ = []
-    words = text.split(" ")
-    _txt_ = ""
-    for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _txt_.strip() == word.strip():
+    _line_ = []
+    _line_width_ = 0
+    for word in text.split(" "):
+        word_width = get_text_width(word)
+        if not _line_:
+            if word_width > max_width:
                 processed = False
                 break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
-    _wrapped_lines_.append(_txt_)
+            _line_ = [word]
+            _line_width_ = word_width
+        elif _line_width_ + space_width + word_width <= max_width:
+            _line_.append(word)
+            _line_width_ += space_width + word_width
+        else:
+            _wrapped_lines_.append(" ".join(_line_))
+            _line_ = [word]
+            _line_width_ = word_width
     if processed:
+        _wrapped_lines_.append(" ".join(_line_))
         _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
         result = "\n".join(_wrapped_lines_).strip()
         height = len(_wrapped_lines_) * height
         # logger.warning(f"wrapped text: {result}")
         return result, height
 
+    # No spaces to break at (e.g. Chinese), break between characters
     _wrapped_lines_ = []
-    chars = list(text)
     _txt_ = ""
-    for word in chars:
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
+    _line_width_ = 0
+    for char in text:
+        char_width = get_text_width(char)
+        if _txt_ and _line_width_ + char_width > max_width:
             _wrapped_lines_.append(_txt_)
             _txt_ = ""
+            _line_width_ = 0
+        _txt_ += char
+        _line_width_ += char_width
     _wrapped_lines_.append(_txt_)
     result = "\n".join(_wrapped_lines_).strip()
     height = len(_wrapped_lines_) * height
@@ -251,8 +472,9 @@ def generate_video(
     params: VideoParams,
     progress_callback=None,
 ):
-    aspect = VideoAspect(params.video_aspect)
-    video_width, video_height = aspect.to_resolution()
+    video_width, video_height = get_resolution(
+        params.video_aspect, params.render_profile
+    )
 
     logger.info(f"start, video size: {video_width} x {video_height}")
     logger.info(f"  ① video: {video_path}")
@@ -260,11 +482,225 @@ def generate_video(
     logger.info(f"  ③ subtitle: {subtitle_path}")
     logger.info(f"  ④ output: {output_file}")
 
-    # https://github.com/harry0703/MoneyPrinterTurbo/issues/217
-    # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
-    # write into the same directory as the output file
-    output_dir = os.path.dirname(output_file)
+    if _can_mux(video_path, subtitle_path, params):
+        if _mux_audio(video_path, audio_path, output_file, params):
+            logger.success("completed")
+            return
+        logger.warning("failed to mux audio, fallback to moviepy")
+
+    fps = get_render_profile(params.render_profile)["fps"]
+    workers = _get_render_workers()
+    if workers > 1:
+        shards = _split_video(video_path, workers, fps)
+        if _render_final_shards(
+            output_file, shards, workers, audio_path, subtitle_path, params
+        ):
+            logger.success("completed")
+            return
+        logger.warning("failed to render in parallel, fallback to moviepy")
+
+    with _reader_pool() as reader_pool:
+        video_clip = build_final_clip(
+            video_clip=_fit_clip(
+                reader_pool.get(video_path), video_width, video_height
+            ),
+            subtitle_path=subtitle_path,
+            params=params,
+        )
+        _write_final_clip(
+            video_clip,
+            output_file,
+            params,
+            progress_callback,
+            subtitle_path,
+            audio_path,
+        )
+
+
+def render_video(
+    video_paths: List[str],
+    audio_path: str,
+    subtitle_path: str,
+    output_file: str,
+    params: VideoParams,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    combined_video_path: str = "",
+    progress_callback=None,
+    video_timeline: Timeline = None,
+):
+    """
+    Single-pass render: the material timeline, subtitle overlay and audio are
+    encoded by one write_videofile call instead of combine_videos followed by
+    generate_video. The intermediate combined video is only written when
+    `combined_video_path` is given. A timeline is planned from `video_paths`
+    unless `video_timeline` is passed in.
+    """
+    aspect = VideoAspect(params.video_aspect)
+    render_profile = params.render_profile
+    video_width, video_height = get_resolution(aspect, render_profile)
+
+    logger.info(f"start single-pass render, video size: {video_width} x {video_height}")
+    logger.info(f"  ① videos: {len(video_paths)}")
+    logger.info(f"  ② audio: {audio_path}")
+    logger.info(f"  ③ subtitle: {subtitle_path}")
+    logger.info(f"  ④ output: {output_file}")
+
+    if not video_timeline:
+        video_timeline = timeline.plan(
+            video_paths=video_paths,
+            audio_duration=timeline.get_duration(audio_path),
+            video_aspect=aspect,
+            video_concat_mode=video_concat_mode,
+            video_transition_mode=params.video_transition_mode,
+            max_clip_duration=params.video_clip_duration,
+        )
+    video_timeline = _normalize_materials(video_timeline, render_profile)
+    segments = video_timeline.segments
+
+    # without effects the timeline can be joined by stream copy, so the only
+    # encode left is the final one
+    concat_file = ""
+    if can_concat_segments(segments, render_profile):
+        concat_file = combined_video_path or ffmpeg.temp_path(
+            output_file, tag="combined"
+        )
+        if not concat_segments(segments, concat_file):
+            logger.warning("failed to concat segments, fallback to moviepy")
+            concat_file = ""
+
+    if not concat_file and combined_video_path:
+        logger.info(f"writing combined video: {combined_video_path}")
+        if progress_callback:
+            progress_callback(60, "Writing Combined Videos")
+        _write_segments(
+            segments,
+            aspect,
+            combined_video_path,
+            params.n_threads or 2,
+            render_profile,
+        )
+        concat_file = combined_video_path
+
+    try:
+        if concat_file and _can_mux(concat_file, subtitle_path, params):
+            if _mux_audio(concat_file, audio_path, output_file, params):
+                logger.success("completed")
+                return
+            logger.warning("failed to mux audio, fallback to moviepy")
+
+        workers = _get_render_workers()
+        if workers > 1:
+            if concat_file:
+                fps = get_render_profile(render_profile)["fps"]
+                shards = _split_video(concat_file, workers, fps)
+            else:
+                shards = _split_segments(segments, workers)
+            if _render_final_shards(
+                output_file, shards, workers, audio_path, subtitle_path, params
+            ):
+                logger.success("completed")
+                return
+            logger.warning("failed to render in parallel, fallback to moviepy")
+
+        with _reader_pool() as reader_pool:
+            if concat_file:
+                video_clip = reader_pool.get(concat_file)
+            else:
+                video_clip = build_segments_clip(
+                    segments, aspect, reader_pool, render_profile
+                )
+
+            video_clip = build_final_clip(
+                video_clip=video_clip,
+                subtitle_path=subtitle_path,
+                params=params,
+            )
+            _write_final_clip(
+                video_clip,
+                output_file,
+                params,
+                progress_callback,
+                subtitle_path,
+                audio_path,
+            )
+            logger.debug(f"video readers: {reader_pool.stats()}")
+    finally:
+        if concat_file and concat_file != combined_video_path:
+            try:
+                os.remove(concat_file)
+            except Exception as e:
+                logger.warning(f"failed to remove temp file: {concat_file} => {str(e)}")
+
+
+def _can_mux(video_path: str, subtitle_path: str, params: VideoParams) -> bool:
+    """
+    Whether `video_path` can become the final video as is, with only the
+    audio added: nothing to burn in and already at the size and frame rate
+    of the render profile.
+    """
+    if subtitle_path and os.path.exists(subtitle_path):
+        return False
+    try:
+        info = ffmpeg.probe(video_path)
+    except Exception as e:
+        logger.warning(f"failed to probe video: {video_path} => {str(e)}")
+        return False
+    size = get_resolution(params.video_aspect, params.render_profile)
+    fps = get_render_profile(params.render_profile)["fps"]
+    return (info["width"], info["height"]) == size and round(info["fps"]) == fps
+
+
+def _mux_audio(
+    video_file: str,
+    audio_path: str,
+    output_file: str,
+    params: VideoParams,
+    duration: float = None,
+) -> bool:
+    """
+    Mix the audio for `video_file` and mux both streams into `output_file`
+    by stream copy, the video is not encoded again.
+    """
+    audio_file = ffmpeg.temp_path(output_file, tag="audio", ext=".m4a")
+    try:
+        if duration is None:
+            # probed directly, video_file is often a temp file that must not
+            # leave a metadata sidecar behind
+            duration = ffmpeg.probe(video_file)["duration"]
+        build_audio_file(audio_path, params, duration, audio_file)
+        return ffmpeg.mux(video_file, audio_file, output_file)
+    except Exception as e:
+        logger.error(f"failed to mux audio: {str(e)}")
+        return False
+    finally:
+        if os.path.exists(audio_file):
+            os.remove(audio_file)
 
+
+def _fit_clip(video_clip, width: int, height: int):
+    """
+    Letterbox a rendered video (e.g. a combined video of another render
+    profile) to the output size when it differs.
+    """
+    if tuple(video_clip.size) == (width, height):
+        return video_clip
+    logger.info(f"resizing video to {width} x {height}, size: {video_clip.size}")
+    return video_effects.letterbox(video_clip, width, height)
+
+
+def build_final_clip(
+    video_clip,
+    subtitle_path: str,
+    params: VideoParams,
+):
+    """
+    Overlay subtitles on `video_clip`. The audio is mixed on its own by
+    build_audio_file and muxed in when the clip is written.
+    """
+    return overlay_subtitles(video_clip, subtitle_path, params)
+
+
+def _get_font_path(params: VideoParams) -> str:
     font_path = ""
     if params.subtitle_enabled:
         if not params.font_name:
@@ -274,145 +710,573 @@ def generate_video(
             font_path = font_path.replace("\\", "/")
 
         logger.info(f"using font: {font_path}")
+    return font_path
 
-    def create_text_clip(subtitle_item):
-        params.font_size = int(params.font_size)
-        params.stroke_width = int(params.stroke_width)
-        phrase = subtitle_item[1]
-        max_width = video_width * 0.9
-        wrapped_txt, txt_height = wrap_text(
-            phrase, max_width=max_width, font=font_path, fontsize=params.font_size
-        )
-        _clip = TextClip(
-            text=wrapped_txt,
+
+def _subtitle_y(params: VideoParams, video_height: int, text_height: int) -> float:
+    """
+    Top of a cue of `text_height` pixels for the subtitle position in params.
+    """
+    if params.subtitle_position == "bottom":
+        return video_height * 0.95 - text_height
+    elif params.subtitle_position == "top":
+        return video_height * 0.05
+    elif params.subtitle_position == "custom":
+        # Ensure the subtitle is fully within the screen bounds
+        margin = 10  # Additional margin, in pixels
+        max_y = video_height - text_height - margin
+        min_y = margin
+        custom_y = (video_height - text_height) * (params.custom_position / 100)
+        # Constrain the y value within the valid range
+        return max(min_y, min(custom_y, max_y))
+    else:  # center
+        return (video_height - text_height) / 2
+
+
+def _subtitle_sizes(params: VideoParams):
+    """
+    Font size and stroke width of the subtitles, scaled like the video by
+    the render profile.
+    """
+    params.font_size = int(params.font_size)
+    params.stroke_width = int(params.stroke_width)
+    scale = get_render_profile(params.render_profile)["scale"]
+    return max(1, round(params.font_size * scale)), int(params.stroke_width * scale)
+
+
+@lru_cache(maxsize=256)
+def _subtitle_bitmap(
+    text: str,
+    font: str,
+    font_size: int,
+    color,
+    bg_color,
+    stroke_color,
+    stroke_width: int,
+    max_width: float,
+) -> subtitle_layer.Bitmap:
+    """
+    Wrap and rasterize a cue once, identical cues of other segments, variants
+    and tasks in this process reuse the bitmap.
+    """
+    wrapped_txt, _ = wrap_text(text, max_width=max_width, font=font, fontsize=font_size)
+    text_clip = TextClip(
+        text=wrapped_txt,
+        font=font,
+        font_size=font_size,
+        color=color,
+        bg_color=bg_color,
+        stroke_color=stroke_color,
+        stroke_width=stroke_width,
+    )
+    return subtitle_layer.rasterize(text_clip)
+
+
+def overlay_subtitles(
+    video_clip,
+    subtitle_path: str,
+    params: VideoParams,
+    offset: float = 0,
+):
+    """
+    Overlay the cues of `subtitle_path` on `video_clip`. `offset` is the time
+    of the subtitle file at which `video_clip` starts, cues outside the clip
+    are skipped.
+    """
+    if _use_ass_engine():
+        # burnt in by ffmpeg when the clip is written
+        return video_clip
+
+    video_width, video_height = get_resolution(
+        params.video_aspect, params.render_profile
+    )
+    font_path = _get_font_path(params)
+    font_size, stroke_width = _subtitle_sizes(params)
+
+    def create_cue(subtitle_item):
+        bitmap = _subtitle_bitmap(
+            text=subtitle_item[1],
             font=font_path,
-            font_size=params.font_size,
+            font_size=font_size,
             color=params.text_fore_color,
             bg_color=params.text_background_color,
             stroke_color=params.stroke_color,
-            stroke_width=params.stroke_width,
+            stroke_width=stroke_width,
+            max_width=video_width * 0.9,
         )
-        duration = subtitle_item[0][1] - subtitle_item[0][0]
-        _clip = _clip.with_start(subtitle_item[0][0])
-        _clip = _clip.with_end(subtitle_item[0][1])
-        _clip = _clip.with_duration(duration)
-        if params.subtitle_position == "bottom":
-            _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
-        elif params.subtitle_position == "top":
-            _clip = _clip.with_position(("center", video_height * 0.05))
-        elif params.subtitle_position == "custom":
-            # Ensure the subtitle is fully within the screen bounds
-            margin = 10  # Additional margin, in pixels
-            max_y = video_height - _clip.h - margin
-            min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
-            custom_y = max(
-                min_y, min(custom_y, max_y)
-            )  # Constrain the y value within the valid range
-            _clip = _clip.with_position(("center", custom_y))
-        else:  # center
-            _clip = _clip.with_position(("center", "center"))
-        return _clip
-
-    video_clip = VideoFileClip(video_path)
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
+        w, h = bitmap.size
+        start_time = max(subtitle_item[0][0] - offset, 0)
+        end_time = subtitle_item[0][1] - offset
+        x = (video_width - w) / 2
+        y = _subtitle_y(params, video_height, h)
+        return subtitle_layer.Cue(start_time, end_time, int(x), int(y), bitmap)
+
+    if subtitle_path and os.path.exists(subtitle_path):
+        cues = []
+        for item in file_to_subtitles(subtitle_path, encoding="utf-8"):
+            if item[0][1] <= offset or item[0][0] >= offset + video_clip.duration:
+                continue
+            cues.append(create_cue(subtitle_item=item))
+        video_clip = subtitle_layer.overlay(video_clip, cues)
+
+    return video_clip
+
+
+def _use_ass_engine() -> bool:
+    if config.app.get("subtitle_engine", "moviepy") != "ass":
+        return False
+    if not ffmpeg.has_filter("subtitles"):
+        logger.warning("ffmpeg has no subtitles filter (libass), using moviepy")
+        return False
+    return True
+
+
+def write_ass_subtitles(
+    subtitle_path: str,
+    ass_file: str,
+    params: VideoParams,
+    offset: float = 0,
+    duration: float = None,
+):
+    """
+    Convert `subtitle_path` (srt) and the subtitle style of `params` into an
+    ASS script laid out like the moviepy overlay: same wrapping, same
+    positions. Cues are shifted by `offset` and limited to `duration`.
+    """
+    video_width, video_height = get_resolution(
+        params.video_aspect, params.render_profile
     )
+    font_path = _get_font_path(params)
+    font_size, stroke_width = _subtitle_sizes(params)
+
+    font = ImageFont.truetype(font_path, font_size)
+    family, font_style = font.getname()
+    ascent, descent = font.getmetrics()
+    style = {
+        "Fontname": family,
+        # libass sizes fonts by their line height, PIL by their em size
+        "Fontsize": ascent + descent,
+        "PrimaryColour": ass.color(params.text_fore_color, "&H00FFFFFF"),
+        "Bold": -1 if "bold" in font_style.lower() else 0,
+    }
+    box_color = ""
+    if isinstance(params.text_background_color, str):
+        box_color = ass.color(params.text_background_color, "")
+    # "transparent" and fully transparent colors draw no box, like moviepy
+    if box_color and not box_color.startswith("&HFF"):
+        # opaque box, drawn with the outline color instead of the stroke
+        style["BorderStyle"] = 3
+        style["OutlineColour"] = box_color
+        style["Outline"] = max(stroke_width, 1)
+    else:
+        style["OutlineColour"] = ass.color(params.stroke_color)
+        style["Outline"] = stroke_width
 
-    def make_textclip(text):
-        return TextClip(
-            text=text,
+    events = []
+    end_limit = offset + duration if duration else float("inf")
+    for (start, end), text in file_to_subtitles(subtitle_path, encoding="utf-8"):
+        if end <= offset or start >= end_limit:
+            continue
+        wrapped_txt, txt_height = wrap_text(
+            text,
+            max_width=video_width * 0.9,
             font=font_path,
-            font_size=params.font_size,
+            fontsize=font_size,
         )
-
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
+        y = _subtitle_y(params, video_height, txt_height)
+        events.append(
+            (
+                max(start - offset, 0),
+                end - offset,
+                wrapped_txt,
+                video_width // 2,
+                int(y),
+            )
         )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
+    ass.write(ass_file, video_width, video_height, style, events)
+
 
+def _subtitle_ffmpeg_params(
+    subtitle_path: str,
+    ass_file: str,
+    params: VideoParams,
+    offset: float = 0,
+    duration: float = None,
+) -> List[str]:
+    """
+    ffmpeg output arguments that burn the subtitles in when the ASS engine
+    is used, otherwise an empty list.
+    """
+    if not subtitle_path or not os.path.exists(subtitle_path):
+        return []
+    if not _use_ass_engine():
+        return []
+    write_ass_subtitles(subtitle_path, ass_file, params, offset, duration)
+    subtitles_filter = (
+        f"subtitles=filename={ffmpeg.escape_filter_value(ass_file)}"
+        f":fontsdir={ffmpeg.escape_filter_value(utils.font_dir())}"
+    )
+    return ["-vf", subtitles_filter]
+
+
+def build_audio_file(
+    audio_path: str, params: VideoParams, duration: float, output_file: str
+):
+    """
+    Mix the narration with the background music looped to `duration` into
+    the AAC file `output_file`. Raises IOError if it cannot be written.
+    """
     bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
-    if bgm_file:
-        try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
-            )
-            audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
-        except Exception as e:
-            logger.error(f"failed to add bgm: {str(e)}")
+    if not audio_mix.mix(
+        output_file,
+        audio_path,
+        duration,
+        voice_volume=params.voice_volume,
+        bgm_file=bgm_file,
+        bgm_volume=params.bgm_volume,
+    ):
+        raise IOError(f"failed to mix audio: {audio_path}")
 
-    video_clip = video_clip.with_audio(audio_clip)
 
+def _write_final_clip(
+    video_clip,
+    output_file: str,
+    params: VideoParams,
+    progress_callback=None,
+    subtitle_path: str = "",
+    audio_path: str = "",
+):
     if progress_callback:
         progress_callback(70, "Generating Final Videos")
-    video_clip.write_videofile(
-        output_file,
-        audio_codec="aac",
-        temp_audiofile_path=output_dir,
-        threads=params.n_threads or 2,
-        logger=None,
-        fps=30,
-    )
+    # mixed before the encode, which copies the audio stream in
+    audio_file = ffmpeg.temp_path(output_file, tag="audio", ext=".m4a")
+    ass_file = ffmpeg.temp_path(output_file, tag="subtitles", ext=".ass")
+    try:
+        if audio_path:
+            build_audio_file(audio_path, params, video_clip.duration, audio_file)
+        ffmpeg_params = _subtitle_ffmpeg_params(
+            subtitle_path, ass_file, params, duration=video_clip.duration
+        )
+        video_clip.write_videofile(
+            output_file,
+            audio=audio_file if audio_path else False,
+            threads=params.n_threads or 2,
+            logger=None,
+            **_encoder_params(params.render_profile, ffmpeg_params),
+        )
+    finally:
+        for file in [audio_file, ass_file]:
+            if os.path.exists(file):
+                os.remove(file)
     video_clip.close()
     del video_clip
     logger.success("completed")
 
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
-    for material in materials:
-        if not material.url:
-            continue
+def _get_render_workers() -> int:
+    workers = config.app.get("render_workers", 0)
+    if workers == "auto":
+        workers = os.cpu_count() or 1
+    return int(workers or 0)
 
-        ext = utils.parse_extension(material.url)
-        try:
-            clip = VideoFileClip(material.url)
-        except Exception:
-            clip = ImageClip(material.url)
-
-        width = clip.size[0]
-        height = clip.size[1]
-        if width < 480 or height < 480:
-            logger.warning(f"video is too small, width: {width}, height: {height}")
-            continue
 
-        if ext in const.FILE_TYPE_IMAGES:
-            logger.info(f"processing image: {material.url}")
-            # Create an image clip and set its duration to 3 seconds
-            clip = (
-                ImageClip(material.url)
-                .with_duration(clip_duration)
-                .with_position("center")
+def _split_segments(segments: List[TimelineSegment], workers: int) -> List[dict]:
+    """
+    Group consecutive segments into at most `workers` shards of about the
+    same duration. Shards only break between segments, so no segment is split,
+    and never before a crossfade, which needs the end of the previous segment.
+    """
+    total_duration = sum(s.duration - s.overlap for s in segments)
+    shard_duration = total_duration / workers
+
+    shards = []
+    shard_segments = []
+    shard_start = 0
+    video_duration = 0
+    for index, segment in enumerate(segments):
+        shard_segments.append(segment)
+        video_duration += segment.duration - segment.overlap
+        next_overlap = segments[index + 1].overlap if index + 1 < len(segments) else 0
+        if (
+            video_duration - shard_start >= shard_duration
+            and len(shards) < workers - 1
+            and not next_overlap
+        ):
+            shards.append(
+                {
+                    "start": shard_start,
+                    "end": video_duration,
+                    "segments": shard_segments,
+                }
             )
-            # Apply a zoom effect using the resize method.
-            # A lambda function is used to make the zoom effect dynamic over time.
-            # The zoom effect starts from the original size and gradually scales up to 120%.
-            # t represents the current time, and clip.duration is the total duration of the clip (3 seconds).
-            # Note: 1 represents 100% size, so 1.2 represents 120% size.
-            zoom_clip = clip.resized(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
+            shard_segments = []
+            shard_start = video_duration
+    if shard_segments:
+        shards.append(
+            {"start": shard_start, "end": video_duration, "segments": shard_segments}
+        )
+    return shards
+
+
+def _split_video(video_path: str, workers: int, fps: int = 30) -> List[dict]:
+    """
+    Split a video file into `workers` time ranges, cut on frame boundaries.
+    """
+    # a rendered (often temporary) file, no metadata sidecar is kept for it
+    duration = ffmpeg.probe(video_path)["duration"]
+    bounds = [round(duration * i / workers * fps) / fps for i in range(workers)]
+    bounds.append(duration)
+    return [
+        {"start": bounds[i], "end": bounds[i + 1], "video_path": video_path}
+        for i in range(workers)
+        if bounds[i + 1] > bounds[i]
+    ]
+
+
+def _render_shard(
+    shard_file: str,
+    shard: dict,
+    video_aspect: VideoAspect,
+    subtitle_path: str = "",
+    params: VideoParams = None,
+    threads: int = 1,
+    render_profile: RenderProfile = None,
+) -> str:
+    """
+    Render one shard without audio, runs in a worker process.
+    """
+    with _reader_pool() as reader_pool:
+        if shard.get("segments"):
+            video_clip = build_segments_clip(
+                shard["segments"], video_aspect, reader_pool, render_profile
+            )
+        else:
+            video_clip = _fit_clip(
+                reader_pool.get(shard["video_path"]),
+                *get_resolution(video_aspect, render_profile),
             )
+            video_clip = video_clip.subclipped(shard["start"], shard["end"])
+
+        ffmpeg_params = []
+        ass_file = ffmpeg.temp_path(shard_file, tag="subtitles", ext=".ass")
+        if params and subtitle_path:
+            video_clip = overlay_subtitles(
+                video_clip, subtitle_path, params, offset=shard["start"]
+            )
+            ffmpeg_params = _subtitle_ffmpeg_params(
+                subtitle_path,
+                ass_file,
+                params,
+                offset=shard["start"],
+                duration=video_clip.duration,
+            )
+
+        try:
+            video_clip.write_videofile(
+                shard_file,
+                audio=False,
+                threads=threads,
+                logger=None,
+                **_encoder_params(render_profile, ffmpeg_params),
+            )
+        finally:
+            if os.path.exists(ass_file):
+                os.remove(ass_file)
+        video_clip.close()
+    return shard_file
+
+
+def render_shards(
+    output_file: str,
+    shards: List[dict],
+    video_aspect: VideoAspect,
+    workers: int,
+    subtitle_path: str = "",
+    params: VideoParams = None,
+    render_profile: RenderProfile = None,
+) -> bool:
+    """
+    Render shards in a pool of `workers` processes, each with its own moviepy
+    pipeline and encoder, and join them by stream copy into a silent video.
+    """
+    temp_file = ffmpeg.temp_path(output_file)
+    shard_files = [
+        ffmpeg.temp_path(output_file, tag=f"shard-{i}") for i in range(len(shards))
+    ]
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logger.info(f"rendering {len(shards)} shards with {workers} workers")
+
+    try:
+        # spawn instead of fork, the parent has encoder and logger threads running
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _render_shard,
+                    shard_file,
+                    shard,
+                    VideoAspect(video_aspect),
+                    subtitle_path,
+                    params,
+                    threads,
+                    render_profile,
+                )
+                for shard_file, shard in zip(shard_files, shards)
+            ]
+            for future in futures:
+                future.result()
+
+        if not ffmpeg.concat([{"file": f} for f in shard_files], temp_file):
+            return False
+        os.replace(temp_file, output_file)
+        return True
+    except Exception as e:
+        logger.error(f"failed to render shards: {repr(e)}")
+        return False
+    finally:
+        for file in [temp_file, *shard_files]:
+            if os.path.exists(file):
+                os.remove(file)
+
+
+def _write_segments(
+    segments: List[TimelineSegment],
+    video_aspect: VideoAspect,
+    output_file: str,
+    threads: int,
+    render_profile: RenderProfile = None,
+):
+    workers = _get_render_workers()
+    if workers > 1 and len(segments) > 1:
+        shards = _split_segments(segments, workers)
+        if render_shards(
+            output_file,
+            shards,
+            video_aspect,
+            workers,
+            render_profile=render_profile,
+        ):
+            return
+        logger.warning("failed to render in parallel, fallback to moviepy")
+
+    with _reader_pool() as reader_pool:
+        video_clip = build_segments_clip(
+            segments, video_aspect, reader_pool, render_profile
+        )
+        video_clip.write_videofile(
+            filename=output_file,
+            threads=threads,
+            logger=None,
+            audio=False,
+            **_encoder_params(render_profile),
+        )
+        video_clip.close()
+
+
+def _render_final_shards(
+    output_file: str,
+    shards: List[dict],
+    workers: int,
+    audio_path: str,
+    subtitle_path: str,
+    params: VideoParams,
+) -> bool:
+    """
+    Render the final video in parallel shards, then mux in the mixed audio.
+    """
+    video_file = ffmpeg.temp_path(output_file, tag="video")
+    try:
+        if not render_shards(
+            video_file,
+            shards,
+            params.video_aspect,
+            workers,
+            subtitle_path=subtitle_path,
+            params=params,
+            render_profile=params.render_profile,
+        ):
+            return False
+
+        return _mux_audio(
+            video_file, audio_path, output_file, params, shards[-1]["end"]
+        )
+    finally:
+        if os.path.exists(video_file):
+            os.remove(video_file)
+
+
+def _get_preprocess_workers() -> int:
+    workers = config.app.get("preprocess_workers", 0)
+    if not workers or workers == "auto":
+        return os.cpu_count() or 1
+    return int(workers)
+
+
+def _preprocess_material(file_path: str, clip_duration: int) -> str:
+    """
+    Check one local material, returns the path to render it from, or "" if it
+    cannot be used.
+    """
+    info = metadata.get_info(file_path)
+    if not info.get("video_found"):
+        logger.warning(f"invalid material: {file_path}")
+        return ""
+
+    width = info["width"]
+    height = info["height"]
+    if width < 480 or height < 480:
+        logger.warning(f"video is too small, width: {width}, height: {height}")
+        return ""
+
+    if utils.parse_extension(file_path) in const.FILE_TYPE_IMAGES:
+        # large enough for the strongest zoom of the clip on any video aspect
+        max_zoom = 1 + const.IMAGE_ZOOM_SPEED * clip_duration
+        return material.prepare_image(
+            file_path, math.ceil(const.IMAGE_MAX_SIZE * max_zoom)
+        )
+    return file_path
+
+
+def preprocess_video(
+    materials: List[MaterialInfo], clip_duration=4, progress_callback=None
+):
+    """
+    Probe local materials and prepare images, in a pool of threads (the work
+    runs in ffmpeg and PIL, which release the GIL). Materials that cannot be
+    used are dropped. Images are zoomed in while the video is rendered.
+    """
+    materials = [m for m in materials if m.url]
+    if not materials:
+        return []
+
+    workers = min(_get_preprocess_workers(), len(materials))
+    logger.info(f"preprocessing {len(materials)} materials with {workers} workers")
+    valid_materials = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_preprocess_material, m.url, clip_duration): m
+            for m in materials
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            material_info = futures[future]
+            try:
+                file_path = future.result()
+            except Exception as e:
+                logger.error(
+                    f"failed to preprocess material: {material_info.url} => {str(e)}"
+                )
+                file_path = ""
+            if file_path:
+                material_info.url = file_path
+                valid_materials.append(material_info)
+            if progress_callback:
+                progress_callback(
+                    45, "Preprocessing Materials", f"{done}/{len(materials)}"
+                )
 
-            # Optionally, create a composite video clip containing the zoomed clip.
-            # This is useful when you want to add other elements to the video.
-            final_clip = CompositeVideoClip([zoom_clip])
-
-            # Output the video to a file.
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None)
-            final_clip.close()
-            del final_clip
-            material.url = video_file
-            logger.success(f"completed: {video_file}")
-    return materials
+    # keep the order of the request, sequential concat mode relies on it
+    return [m for m in materials if m in valid_materials]
 
 
 if __name__ == "__main__":
@@ -42,6 +42,7 @@ VIDEO_TRANSITION_MODES = {
     VideoTransitionMode.fade_out: tr("FadeOut"),
     VideoTransitionMode.slide_in: tr("SlideIn"),
     VideoTransitionMode.slide_out: tr("SlideOut"),
+    VideoTransitionMode.crossfade: tr("Crossfade"),
 }
 
 VIDEO_ASPECT_RATIOS = {